@@ -0,0 +1,62 @@
+"""Benchmark: shared vectorised FINESS cleaning vs the per-cell lambda chain.
+
+Run from the repository root, optionally on a local copy of the extract:
+
+    python benchmarks/finess_clean.py [path-or-url-of-extract]
+
+Without an argument the latest release is resolved from data.gouv.
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dq.finess import TAM_COLUMNS, VOIE_TYPES, clean_finess, fetch_release, load_finess  # noqa: E402
+
+
+def legacy_clean(final):
+    """The cleaning chain the pages ran before dq.finess.clean_finess."""
+    final = final.copy()
+    final['voie_type'] = final['voie_type'].astype(object).replace(VOIE_TYPES)
+    final['raison_sociale'] = final['raison_sociale'].apply(lambda x: str(x).replace('.0', '').replace('nan', ''))
+    final['adresse'] = (
+        final['voie_numero'].apply(lambda x: str(x).replace('.0', '').replace('nan', ''))
+        + final['voie_complement'].apply(lambda x: str(x).replace('.0', '').replace('nan', ''))
+        + ' ' + final['voie_type'] + ' ' + final['voie_label']
+    )
+    final['code_postal'] = final['ligne_acheminement'].apply(lambda x: str(re.search(r'\d\d\d\d\d|$', str(x))[0]))
+    final['ville'] = final['ligne_acheminement'].apply(lambda x: re.split(r'\d\d\d\d\d|$', str(x))[1].strip(' '))
+    final.rename(columns={"ligne_acheminement": "libelle_routage"}, inplace=True)
+    final['telephone'] = final['telephone'].apply(lambda x: ('+33' + str(x).replace('.0', '')).replace('+33nan', ''))
+    final['fax'] = final['fax'].apply(lambda x: ('+33' + str(x).replace('.0', '')).replace('+33nan', ''))
+    for col in ['siret', 'code_categorie', 'code_status', 'code_psph']:
+        final[col] = final[col].apply(lambda x: str(x).replace('.0', '').replace('nan', ''))
+    final['ape'] = final['ape'].apply(lambda x: str(x).replace(' ', '').replace('nan', ''))
+    return final
+
+
+def best_of(func, df, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else fetch_release()[0]
+    final = load_finess(url, TAM_COLUMNS)
+    print(f"{len(final)} establishments")
+
+    legacy = best_of(legacy_clean, final)
+    vectorised = best_of(clean_finess, final)
+    print(f"lambda chain : {legacy:.3f}s")
+    print(f"clean_finess : {vectorised:.3f}s")
+    print(f"speedup      : x{legacy / vectorised:.1f}")
+
+
+if __name__ == '__main__':
+    main()
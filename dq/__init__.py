@@ -0,0 +1 @@
+"""Shared data helpers for the DQ Projects/Operations pages."""
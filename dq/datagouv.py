@@ -0,0 +1,92 @@
+"""Release metadata of the FINESS datasets, from the data.gouv.fr API.
+
+The dataset endpoint of the API describes every resource of a dataset (URL,
+checksum, size, last modification) as JSON, so the pages do not scrape the
+dataset HTML pages. The metadata of all the FINESS datasets is fetched
+together, the requests running concurrently, and kept for ``METADATA_TTL``
+seconds by the process so that every page and session shares it.
+"""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+
+API_URL = "https://www.data.gouv.fr/api/1/datasets/{slug}/"
+METADATA_TTL = 3600
+
+# Dataset slug and the file-code hint of the resource the pages read in it.
+FINESS_DATASETS = {
+    'etablissements': ('finess-extraction-du-fichier-des-etablissements', 'cs1100507'),
+    'juridique': ('finess-extraction-des-entites-juridiques', 'cs1100501'),
+}
+
+# ``checksum`` is an (algorithm, hexdigest) pair or None; ``date`` is the
+# last modification as shown on the pages (dd/mm/YYYY).
+Release = namedtuple('Release', ['url', 'checksum', 'filesize', 'last_modified', 'date'])
+
+releases_cache = {'fetched_at': None, 'releases': None}
+releases_lock = threading.Lock()
+
+
+def fetch_dataset(slug, timeout=60):
+    response = requests.get(API_URL.format(slug=slug), timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def pick_resource(dataset, hint):
+    """Latest main CSV resource of ``dataset``, preferring those whose URL contains ``hint``."""
+    resources = [
+        r for r in dataset.get('resources', [])
+        if r.get('type', 'main') == 'main' and (r.get('format') or '').lower() == 'csv'
+    ]
+    preferred = [r for r in resources if hint and hint in (r.get('url') or '')]
+    candidates = preferred or resources
+    if not candidates:
+        raise ValueError(f"No CSV resource in data.gouv dataset {dataset.get('slug')}")
+    return max(candidates, key=lambda r: r.get('last_modified') or '')
+
+
+def to_release(resource):
+    checksum = resource.get('checksum') or {}
+    last_modified = pd.to_datetime(resource.get('last_modified'), errors='coerce', utc=True)
+    return Release(
+        url=resource['url'],
+        checksum=(checksum['type'], checksum['value']) if checksum.get('value') else None,
+        filesize=resource.get('filesize'),
+        last_modified=last_modified,
+        date=last_modified.strftime('%d/%m/%Y') if pd.notna(last_modified) else None,
+    )
+
+
+def finess_releases(timeout=60):
+    """Current ``Release`` of every FINESS dataset, keyed like ``FINESS_DATASETS``."""
+    with releases_lock:
+        fetched_at = releases_cache['fetched_at']
+        if fetched_at is not None and time.monotonic() - fetched_at < METADATA_TTL:
+            return releases_cache['releases']
+
+        with ThreadPoolExecutor(max_workers=len(FINESS_DATASETS)) as pool:
+            datasets = dict(zip(
+                FINESS_DATASETS,
+                pool.map(lambda slug: fetch_dataset(slug, timeout),
+                         [slug for slug, _ in FINESS_DATASETS.values()]),
+            ))
+        releases = {
+            name: to_release(pick_resource(datasets[name], hint))
+            for name, (_, hint) in FINESS_DATASETS.items()
+        }
+        releases_cache.update(fetched_at=time.monotonic(), releases=releases)
+        return releases
+
+
+def known_checksum(url):
+    """Checksum data.gouv published for the resource at ``url``, if it was resolved here."""
+    releases = releases_cache['releases'] or {}
+    for release in releases.values():
+        if release.url == url:
+            return release.checksum
+    return None
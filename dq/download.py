@@ -0,0 +1,234 @@
+"""Local mirror of the remote files the pages read (data.gouv extracts, Ordre annuaire).
+
+``download(url, name)`` returns a local path to the current content of ``url``:
+
+- a published copy is revalidated with ``If-None-Match`` / ``If-Modified-Since``,
+  so an unchanged file costs one small request answered by ``304``;
+- bytes go to a ``.part`` file first; an interrupted transfer is resumed with a
+  ``Range`` request guarded by ``If-Range``, so a file that changed upstream in
+  the meantime is downloaded again from the start;
+- the size announced by the server and, when known, a checksum are verified
+  before the file is atomically published.
+
+Streamlit sessions are threads of one process: a lock per mirrored file makes
+concurrent calls for the same release wait for the first one and reuse its
+result, and every file is written under a temporary name unique to its writer.
+
+Each mirrored file has a ``.json`` sidecar with its validators and size.
+Only the latest file of each ``name`` is kept.
+
+The caches built from these files (FINESS and Ordre snapshots, match
+registry) are published the same way, with ``write_parquet``.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+CACHE_DIR = Path(os.environ.get("TAM_CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+MIRROR_DIR = CACHE_DIR / 'mirror'
+CHUNK_SIZE = 1 << 20
+
+# Lock of each mirrored file and when it was last revalidated (time.monotonic()).
+target_locks = {}
+target_locks_lock = threading.Lock()
+checked_at = {}
+
+
+def mirror_path(url, name, mirror_dir=None):
+    """Local file mirroring ``url``, named ``{name}_{key}{suffix}``."""
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    suffix = Path(urlparse(url).path).suffix
+    return Path(mirror_dir or MIRROR_DIR) / f"{name}_{key}{suffix}"
+
+
+def meta_path(path):
+    return path.with_name(f"{path.name}.json")
+
+
+def read_meta(path):
+    try:
+        with open(meta_path(path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def temp_path(path):
+    """New empty file next to ``path``, with a name no other writer uses."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix='.tmp')
+    # mkstemp makes the file private; published files keep the usual mode.
+    os.fchmod(fd, 0o644)
+    os.close(fd)
+    return Path(tmp)
+
+
+def write_parquet(data, path):
+    """Atomically publish ``data`` at ``path``; whether it was published.
+
+    A DataFrame becomes one Parquet file, a dict of DataFrames a directory of
+    ``{key}.parquet`` files. Only caches are written this way, so a failure
+    (disk full, a column Parquet cannot store, a directory another session
+    published first) leaves nothing behind and is not raised: the page goes
+    on without the cache.
+    """
+    tmp = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(data, dict):
+            tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=f"{path.name}.", suffix='.tmp'))
+            os.chmod(tmp, 0o755)
+            for key, df in data.items():
+                df.to_parquet(tmp / f"{key}.parquet", index=False)
+        else:
+            tmp = temp_path(path)
+            data.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        return True
+    except (OSError, ValueError, TypeError):
+        if tmp is not None and tmp.is_dir():
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif tmp is not None:
+            tmp.unlink(missing_ok=True)
+        return False
+
+
+def target_lock(path):
+    with target_locks_lock:
+        return target_locks.setdefault(path, threading.Lock())
+
+
+def write_meta(path, meta):
+    target = meta_path(path)
+    tmp = temp_path(target)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp, target)
+
+
+def file_digest(path, algorithm='sha256'):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def total_size(response):
+    """Full size of the remote file from a 200 or 206 response, if the server says."""
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def prune(path):
+    """Drop the other mirrored files of the same name (older releases)."""
+    name = path.name.rsplit('_', 1)[0]
+    for old in path.parent.glob(f"{name}_{'[0-9a-f]' * 16}*"):
+        # Temporary files belong to writers still at work.
+        if not old.name.startswith(path.name) and not old.name.endswith('.tmp'):
+            old.unlink(missing_ok=True)
+
+
+def download(url, name, checksum=None, timeout=60, mirror_dir=None):
+    """Return a local path holding the current content of ``url``.
+
+    ``checksum`` is an optional ``(algorithm, hexdigest)`` pair, e.g. the
+    ``('sha1', ...)`` data.gouv publishes for its resources; a mismatch raises
+    ``ValueError`` and nothing is published. Local paths are returned unchanged.
+    """
+    if os.path.exists(url):
+        return Path(url)
+
+    path = mirror_path(url, name, mirror_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    asked_at = time.monotonic()
+    with target_lock(path):
+        # The call holding the lock meanwhile has just revalidated the file.
+        if path.exists() and checked_at.get(path, -1) >= asked_at:
+            return path
+        fetch(url, path, checksum, timeout)
+        checked_at[path] = time.monotonic()
+    return path
+
+
+def fetch(url, path, checksum, timeout):
+    """Revalidate or (re)download ``url`` into ``path``; the caller holds its lock.
+
+    Bytes are written to a temporary file of this call. When the transfer
+    does not complete, they are parked in the ``.part`` file, which the
+    next call moves back to its own temporary file and resumes.
+    """
+    part = path.with_name(f"{path.name}.part")
+    meta = read_meta(path) if path.exists() else {}
+    part_meta = read_meta(part) if part.exists() else {}
+
+    headers = {'Accept-Encoding': 'identity'}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    offset = part.stat().st_size if part.exists() else 0
+    validator = part_meta.get('etag') or part_meta.get('last_modified')
+    if offset and validator:
+        headers['Range'] = f"bytes={offset}-"
+        headers['If-Range'] = validator
+
+    tmp = temp_path(path)
+    if offset:
+        os.replace(part, tmp)
+    try:
+        with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304:
+                return
+            if response.status_code == 416 and offset:
+                # The partial file does not fit the remote one any more: start over.
+                tmp.unlink()
+                meta_path(part).unlink(missing_ok=True)
+                return fetch(url, path, checksum, timeout)
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            size = total_size(response)
+            meta = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            # Record the validators first so an interrupted transfer can resume.
+            write_meta(part, meta)
+            with open(tmp, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+
+        received = tmp.stat().st_size
+        if size is not None and received != size:
+            # Short read: the partial file is parked below, the next call resumes it.
+            raise ValueError(f"Incomplete download of {url}: {received} of {size} bytes")
+        if checksum is not None:
+            algorithm, expected = checksum
+            if file_digest(tmp, algorithm) != expected.lower():
+                tmp.unlink()
+                meta_path(part).unlink(missing_ok=True)
+                raise ValueError(f"Checksum mismatch for {url}")
+
+        meta['size'] = received
+        os.replace(tmp, path)
+        write_meta(path, meta)
+        meta_path(part).unlink(missing_ok=True)
+        prune(path)
+    finally:
+        if tmp.exists():
+            if tmp.stat().st_size:
+                os.replace(tmp, part)
+            else:
+                tmp.unlink()
@@ -0,0 +1,388 @@
+"""FINESS establishments extract: release lookup, parsing and snapshot cache.
+
+Every TAM page works on the same data.gouv release. The first page that asks
+for a release parses it once and stores the merged establishment + geolocation
+table as a Parquet snapshot keyed by the resource URL; every later load, from
+any page or session, reads the snapshot instead of downloading the extract.
+
+The cleaning helpers at the bottom are the one normalisation stage every page
+applies to that table; they work on whole columns.
+"""
+import hashlib
+import io
+import re
+
+import numpy as np
+import pandas as pd
+
+from dq.datagouv import finess_releases, known_checksum
+from dq.download import CACHE_DIR, download, write_parquet
+from dq.phone import normalize_phone
+
+# Bump when the parsed layout changes so old snapshots are not reused.
+SNAPSHOT_VERSION = 7
+
+HEADERS = [
+    'section', 'numero_finess', 'numero_finess_juridique', 'raison_sociale',
+    'raison_sociale_long', 'raison_sociale_complement', 'distribution_complement',
+    'voie_numero', 'voie_type', 'voie_label', 'voie_complement', 'lieu_dit_bp',
+    'ville', 'departement', 'departement_label', 'ligne_acheminement', 'telephone',
+    'fax', 'code_categorie', 'label_categorie', 'code_status', 'label_status',
+    'siret', 'ape', 'code_tarif', 'label_tarif', 'code_psph',
+    'label_psph', 'date_ouverture', 'date_autor', 'date_update', 'num_uai'
+]
+
+GEOLOC_NAMES = [
+    'numero_finess', 'coord_x', 'coord_y', 'source_coord', 'date_update_coord'
+]
+
+STRUCTURE_TAG = b'structureet;'
+GEOLOC_TAG = b'geolocalisation;'
+
+# Declared types of both sections. Identifiers and codes stay text (Arrow
+# strings) so leading zeros survive, repeated labels are read straight into
+# categoricals (Arrow dictionaries) and dates are real dates.
+STRUCTURE_SCHEMA = {
+    'numero_finess': 'str', 'numero_finess_juridique': 'str', 'raison_sociale': 'str',
+    'raison_sociale_long': 'str', 'raison_sociale_complement': 'str', 'distribution_complement': 'str',
+    'voie_numero': 'str', 'voie_type': 'category', 'voie_label': 'str', 'voie_complement': 'str',
+    'lieu_dit_bp': 'str', 'ville': 'str', 'departement': 'category', 'departement_label': 'category',
+    'ligne_acheminement': 'str', 'telephone': 'str', 'fax': 'str', 'code_categorie': 'str',
+    'label_categorie': 'category', 'code_status': 'str', 'label_status': 'category', 'siret': 'str',
+    'ape': 'str', 'code_tarif': 'str', 'label_tarif': 'category', 'code_psph': 'str',
+    'label_psph': 'category', 'date_ouverture': 'date', 'date_autor': 'date', 'date_update': 'date',
+    'num_uai': 'str'
+}
+
+GEOLOC_SCHEMA = {
+    'numero_finess': 'str', 'coord_x': 'float', 'coord_y': 'float',
+    'source_coord': 'category', 'date_update_coord': 'date'
+}
+FINESS_SCHEMA = {**STRUCTURE_SCHEMA, **GEOLOC_SCHEMA}
+
+# Raw columns the TAM pages (MSP, Radiology, HCC, Pharma) build their table from.
+TAM_COLUMNS = [
+    'numero_finess', 'numero_finess_juridique', 'siret', 'ape', 'raison_sociale',
+    'raison_sociale_long', 'distribution_complement', 'voie_numero', 'voie_type',
+    'voie_label', 'voie_complement', 'lieu_dit_bp', 'ligne_acheminement', 'telephone',
+    'fax', 'code_categorie', 'label_categorie', 'code_status', 'label_status',
+    'code_psph', 'date_ouverture', 'date_update', 'num_uai', 'coord_x', 'coord_y'
+]
+
+VOIE_TYPES = {
+    'R': 'RUE', 'PL': 'PLACE', 'RTE': 'ROUTE', 'AV': 'AVENUE',
+    'GR': 'GRANDE RUE', 'ALL': 'ALLEE', 'CHE': 'CHEMIN', 'QUA': 'QUARTIER',
+    'BD': 'BOULEVARD', 'PROM': 'PROMENADE', 'ZA': 'ZONE ARTISANALE',
+    'QU': 'QUAI', 'ESPA': 'ESPACE', 'IMP': 'IMPASSE', 'LD': 'LIEU DIT',
+    'SQ': 'SQUARE', 'LOT': 'LOTISSEMENT',
+    'ZAC': "ZONE D'AMENAGEMENT CONCERTE", 'IMM': 'IMMEUBLE',
+    'RES': 'RESIDENCE', 'CRS': 'COURS', 'ESP': 'ESPLANADE', 'FG': 'FAUBOURG',
+    'CHS': 'CHAUSSEE', 'MTE': 'MONTEE', 'DOM': 'DOMAINE', 'PAS': 'PASSAGE',
+    'SEN': 'SENTIER', 'VAL': 'VALLEE', 'VOI': 'VOIE', 'PKG': 'PARKING',
+    'RLE': 'RUELLE'
+}
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+    # Cleaned text columns use Arrow strings so the .str methods run as native kernels.
+    TEXT_DTYPE = 'string[pyarrow]'
+    ARROW_TEXT_TYPES = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+except ImportError:
+    pacsv = None
+    TEXT_DTYPE = object
+
+
+def fetch_release(dataset='etablissements', timeout=60):
+    """Return the download URL and the release date of a FINESS dataset (see dq.datagouv)."""
+    release = finess_releases(timeout)[dataset]
+    return release.url, release.date
+
+
+def open_extract(url, name='etablissements'):
+    """Open the extract at ``url`` (local path or mirrored download) as raw byte lines."""
+    return open(download(url, name, checksum=known_checksum(url)), 'rb')
+
+
+def split_sections(lines):
+    """Route the byte lines of an extract to one buffer per section, dropping the section tag.
+
+    The extract is a header line followed by ``structureet`` rows and then
+    ``geolocalisation`` rows. Nothing guarantees the two sections have the same
+    length, so rows are routed by their tag rather than by position. Lines stay
+    UTF-8 bytes: the CSV reader decodes them, with no text copy of the file.
+    """
+    etabs, geoloc = io.BytesIO(), io.BytesIO()
+    for line in lines:
+        if line.startswith(STRUCTURE_TAG):
+            etabs.write(line[len(STRUCTURE_TAG):])
+        elif line.startswith(GEOLOC_TAG):
+            geoloc.write(line[len(GEOLOC_TAG):])
+    etabs.seek(0)
+    geoloc.seek(0)
+    return etabs, geoloc
+
+
+def read_text_csv(source, columns, skip_rows=0, categories=()):
+    """Every field of a ``;`` separated UTF-8 file or byte buffer as text, missing when empty.
+
+    The Arrow reader is used directly: it parses on several threads without
+    holding the GIL, while ``pd.read_csv(engine='pyarrow', dtype=...)`` infers
+    types first and converts afterwards, which is several times slower. The
+    columns stay Arrow strings (``TEXT_DTYPE``) rather than Python objects;
+    the ``categories`` columns are dictionary encoded while parsing and
+    arrive as ``category``.
+    """
+    if pacsv is not None:
+        column_types = dict.fromkeys(columns, pa.string())
+        column_types.update(dict.fromkeys(categories, pa.dictionary(pa.int32(), pa.string())))
+        try:
+            table = pacsv.read_csv(
+                source,
+                read_options=pacsv.ReadOptions(column_names=columns, skip_rows=skip_rows),
+                parse_options=pacsv.ParseOptions(delimiter=';'),
+                convert_options=pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+            )
+            # self_destruct frees each Arrow column once converted.
+            return table.to_pandas(types_mapper=ARROW_TEXT_TYPES.get, self_destruct=True)
+        except pa.ArrowInvalid:
+            # The Arrow reader rejects ragged rows that the C parser pads.
+            if isinstance(source, io.BytesIO):
+                source.seek(0)
+    dtype = dict.fromkeys(columns, str if pacsv is None else TEXT_DTYPE)
+    dtype.update(dict.fromkeys(categories, 'category'))
+    return pd.read_csv(source, sep=';', header=None, names=columns, skiprows=skip_rows,
+                       dtype=dtype, encoding='utf-8', engine='c', low_memory=False)
+
+
+def read_section(buf, schema):
+    """Parse one section buffer with its declared schema.
+
+    Fields are read as text, or as categories for the ``category`` columns,
+    so that department ``01`` or a SIRET never goes through a number; numbers
+    and dates are cast afterwards, invalid values becoming missing.
+    """
+    categories = [col for col, kind in schema.items() if kind == 'category']
+    df = read_text_csv(buf, list(schema), categories=categories)
+    for col, kind in schema.items():
+        if kind == 'float':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        elif kind == 'date':
+            df[col] = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
+    return df
+
+
+def read_finess_extract(url):
+    """Download and parse the extract into establishments joined with their coordinates."""
+    with open_extract(url) as lines:
+        etabs_buf, geoloc_buf = split_sections(lines)
+
+    df = read_section(etabs_buf, STRUCTURE_SCHEMA)
+    etabs_buf.close()
+    geoloc = read_section(geoloc_buf, GEOLOC_SCHEMA)
+    geoloc_buf.close()
+    geoloc = geoloc.drop_duplicates(subset='numero_finess')
+
+    return df.merge(geoloc, on='numero_finess', how='left')
+
+
+def snapshot_path(url, name='finess'):
+    """Local snapshot file for the release published at ``url``."""
+    key = hashlib.sha1(f"{SNAPSHOT_VERSION}|{url}".encode('utf-8')).hexdigest()[:16]
+    return CACHE_DIR / f"{name}_{key}.parquet"
+
+
+def read_snapshot(path, columns=None, filters=None):
+    if pacsv is None:
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    # pandas' reader restores text as Python-backed strings: build Arrow ones
+    # straight from the Parquet columns instead, like a fresh parse.
+    table = pq.read_table(path, columns=columns, filters=filters)
+    return table.to_pandas(types_mapper=ARROW_TEXT_TYPES.get, ignore_metadata=True, self_destruct=True)
+
+
+def with_schema_dtypes(df):
+    """``df`` with the declared dtypes: text as ``TEXT_DTYPE`` (NA when missing), categories.
+
+    A fresh parse and a snapshot read give the same table; this settles what
+    the storage does not keep (an all-missing category comes back as text).
+    """
+    for col in df.columns:
+        kind = FINESS_SCHEMA.get(col)
+        if kind == 'str' and df[col].dtype != TEXT_DTYPE:
+            df[col] = df[col].astype(TEXT_DTYPE)
+        elif kind == 'category' and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def write_snapshot(df, path):
+    """Atomically publish ``df`` at ``path`` and drop older snapshots of the same table."""
+    if not write_parquet(df, path):
+        return
+
+    name = path.name.rsplit('_', 1)[0]
+    for old in path.parent.glob(f"{name}_{'?' * 16}.parquet"):
+        if old != path:
+            old.unlink(missing_ok=True)
+
+
+def load_finess(url, columns=None, categories=None):
+    """Return the merged FINESS table for the release at ``url``, parsing it at most once.
+
+    ``columns`` projects the snapshot: only those columns are read from disk.
+    ``categories`` keeps only the establishments whose ``code_categorie`` is
+    listed. The predicate is handed to the Parquet reader, so a scoped page
+    never materializes (or later cleans) the rest of the extract.
+
+    Both paths return the same dtypes (see ``with_schema_dtypes``).
+    """
+    path = snapshot_path(url)
+    filters = None
+    if categories is not None:
+        categories = [str(c) for c in categories]
+        filters = [('code_categorie', 'in', categories)]
+    if path.exists():
+        return with_schema_dtypes(read_snapshot(path, columns, filters))
+
+    final = read_finess_extract(url)
+    write_snapshot(final, path)
+    if categories is not None:
+        final = final[final['code_categorie'].isin(categories)].reset_index(drop=True)
+    return with_schema_dtypes(final[columns].copy() if columns is not None else final)
+
+
+# ============================================================================
+# CLEANING
+# ============================================================================
+# First five-digit run is the postal code; the city is what follows it, up to
+# the next five-digit run (CEDEX lines) or the end of the line.
+ROUTAGE_PATTERN = r'(?P<code_postal>\d{5})(?P<ville>.*?)(?:\d{5}|$)'
+
+# Address text normalisation, shared by the pages that build or match addresses.
+WHITESPACE = re.compile(r'\s+')
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+# Text columns of the extract that only need missing values blanked.
+TEXT_COLUMNS = [
+    'raison_sociale', 'siret', 'code_categorie', 'code_status', 'code_psph'
+]
+
+
+def to_text(series):
+    """Column as plain text with missing values as ``''``.
+
+    Float columns (identifiers parsed as numbers) lose their ``.0`` suffix;
+    unlike ``str.replace('.0', '')`` this never touches a value such as ``10.05``.
+    """
+    if pd.api.types.is_float_dtype(series):
+        values = series.dropna()
+        if (values == values.round()).all():
+            series = series.astype('Int64')
+    if isinstance(series.dtype, pd.StringDtype):
+        return series.fillna('').astype(TEXT_DTYPE)
+    text = series.astype(str).where(series.notna(), '')
+    return text.astype(TEXT_DTYPE)
+
+
+def on_uniques(series, func):
+    """Apply a column transform to the distinct values only, then broadcast back.
+
+    Street types and addresses repeat a lot across establishments, so the
+    string work runs on a few thousand values instead of every row.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    result = func(pd.Series(uniques, dtype=object))
+    return pd.Series(result.array.take(codes), index=series.index)
+
+
+def expand_voie_type(voie_type):
+    """Full street-type labels (``R`` -> ``RUE``) as plain text; missing values stay missing."""
+    return on_uniques(voie_type, lambda v: v.map(VOIE_TYPES).fillna(v))
+
+
+def join_words(*parts):
+    """Join text columns with single spaces, skipping empty parts."""
+    out = parts[0]
+    for part in parts[1:]:
+        sep = np.where((out != '') & (part != ''), ' ', '')
+        out = out + sep + part
+    return out
+
+
+def build_adresse(voie_numero, voie_complement, voie_type, voie_label):
+    """``12B RUE DE LA PAIX`` from the (expanded) street columns."""
+    return join_words(
+        to_text(voie_numero) + to_text(voie_complement), to_text(voie_type), to_text(voie_label)
+    ).str.strip()
+
+
+def split_routage(ligne_acheminement):
+    """Postal code and city of a ``ligne_acheminement`` column, ``''`` when there is no code.
+
+    With pyarrow the pattern runs as one Arrow (RE2) kernel over the column:
+    ``str.extract`` calls Python's ``re`` once per value, even on Arrow strings.
+    """
+    lines = to_text(ligne_acheminement)
+    if pacsv is None:
+        parts = lines.str.extract(ROUTAGE_PATTERN)
+        code_postal, ville = parts['code_postal'], parts['ville']
+    else:
+        parts = pc.extract_regex(pa.array(lines.array), ROUTAGE_PATTERN)
+        code_postal, ville = (
+            pd.Series(pc.struct_field(parts, name).to_pandas(types_mapper=ARROW_TEXT_TYPES.get).array,
+                      index=lines.index)
+            for name in ('code_postal', 'ville')
+        )
+    return code_postal.fillna(''), ville.fillna('').str.strip()
+
+
+def normalize_street(street):
+    """Upper-case street text with single spaces and no punctuation."""
+    return (to_text(street).str.upper().str.strip()
+            .str.replace(WHITESPACE, ' ', regex=True)
+            .str.replace(PUNCTUATION, '', regex=True))
+
+
+def address_key(street, zipcode):
+    """``STREET|ZIPCODE`` matching key of two address columns, None where either is missing.
+
+    The street goes through ``normalize_street`` on distinct values only; the
+    zipcode through ``to_text``, so one read as a number loses its ``.0`` and
+    a missing one is blank, never ``nan`` or ``<NA>``.
+    """
+    missing = (street.isna() | zipcode.isna()).to_numpy()
+    street = on_uniques(street, normalize_street)
+    zipcode = to_text(zipcode).str.strip()
+    key = (street.astype(object) + '|' + zipcode.astype(object)).to_numpy(dtype=object)
+    key[missing] = None
+    return pd.Series(key, index=street.index, dtype=object)
+
+
+def to_phone(series):
+    """Phone numbers in E.164 (see ``dq.phone.normalize_phone``), ``''`` when missing."""
+    return normalize_phone(series)[0].fillna('').astype(object)
+
+
+def clean_finess(final):
+    """Cleaned copy of a FINESS table: address, postal code, city, phones and text fields.
+
+    Works on any projection of the snapshot; columns that are not there are skipped.
+    """
+    final = final.copy()
+    for col in TEXT_COLUMNS:
+        if col in final.columns:
+            final[col] = to_text(final[col])
+    if 'ape' in final.columns:
+        final['ape'] = to_text(final['ape']).str.replace(' ', '', regex=False)
+    for col in ['telephone', 'fax']:
+        if col in final.columns:
+            final[col] = to_phone(final[col])
+
+    final['voie_type'] = expand_voie_type(final['voie_type'])
+    final['adresse'] = build_adresse(final['voie_numero'], final['voie_complement'],
+                                     final['voie_type'], final['voie_label'])
+    final['code_postal'], final['ville'] = split_routage(final['ligne_acheminement'])
+    return final.rename(columns={'ligne_acheminement': 'libelle_routage'})
@@ -0,0 +1,73 @@
+"""Projection of FINESS coordinates to longitude / latitude.
+
+FINESS publishes establishment coordinates in projected systems: Lambert-93
+for metropolitan France and a UTM zone for each overseas department. The
+system is named at the end of the geolocation ``source_coord`` field
+(``1,ATLASANTE,100,IGN,BD_ADRESSE,V2.2,UTM_N20``). Pages that need WGS84
+coordinates project whole columns at once, one batch per source system, with
+a pyproj ``Transformer`` built once per process and system.
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+
+LAMBERT_93 = "EPSG:2154"
+WGS84 = "EPSG:4326"
+
+# Systems named in ``source_coord``.
+SOURCE_CRS = {
+    'LAMBERT_93': LAMBERT_93,  # Metropolitan France (RGF93 / Lambert-93)
+    'UTM_N20': "EPSG:5490",    # Guadeloupe, Martinique (RGAF09 / UTM 20N)
+    'UTM_N22': "EPSG:2972",    # Guyane (RGFG95 / UTM 22N)
+    'UTM_S40': "EPSG:2975",    # La Réunion (RGR92 / UTM 40S)
+    'UTM_S38': "EPSG:4471",    # Mayotte (RGM04 / UTM 38S)
+}
+
+
+@lru_cache(maxsize=None)
+def get_transformer(source, target=WGS84):
+    """Shared ``source`` -> ``target`` transformer, axis order (x, y) / (lon, lat)."""
+    return Transformer.from_crs(source, target, always_xy=True)
+
+
+def source_crs(source_coord, default=LAMBERT_93):
+    """CRS of each row from its ``source_coord`` field, as an object array.
+
+    Rows without ``source_coord`` get ``default``; rows naming a system that is
+    not in ``SOURCE_CRS`` get NaN rather than a wrong projection.
+    """
+    codes, uniques = pd.factorize(pd.Series(source_coord, dtype=object))
+    names = pd.Series(uniques, dtype=object).str.rsplit(',', n=1).str[-1].str.strip()
+    # Missing values are coded -1, which picks the trailing default.
+    crs = np.append(names.map(SOURCE_CRS).to_numpy(dtype=object), default)
+    return crs[codes]
+
+
+def to_lonlat(coord_x, coord_y, source_coord=None, default=LAMBERT_93):
+    """Project two coordinate columns and return ``(longitude, latitude)`` arrays.
+
+    ``source_coord`` gives the system of each row (see ``source_crs``); without
+    it every point is read in ``default``. Missing or unparsable coordinates
+    give NaN, as do points PROJ cannot project.
+    """
+    x = pd.to_numeric(pd.Series(coord_x), errors='coerce').to_numpy(dtype=float)
+    y = pd.to_numeric(pd.Series(coord_y), errors='coerce').to_numpy(dtype=float)
+    if source_coord is None:
+        crs = np.full(len(x), default, dtype=object)
+    else:
+        crs = source_crs(source_coord, default)
+
+    lon = np.full(len(x), np.nan)
+    lat = np.full(len(x), np.nan)
+    for name in pd.unique(crs):
+        if not isinstance(name, str):
+            continue
+        rows = crs == name
+        lon[rows], lat[rows] = get_transformer(name).transform(x[rows], y[rows])
+
+    invalid = ~(np.isfinite(lon) & np.isfinite(lat))
+    lon[invalid] = np.nan
+    lat[invalid] = np.nan
+    return lon, lat
@@ -0,0 +1,291 @@
+"""Priority matching of two tables on a cascade of candidate keys.
+
+A page that reconciles two registries (Ordre establishments and FINESS, SF
+accounts and FINESS) tries a list of keys from the most to the least specific
+one. A row matched by a rule is out of the later rules, on both sides, so each
+row keeps the pairs of its highest-priority rule only.
+
+Every key column is factorized once over both tables into integer codes;
+each rule then joins integer arrays restricted to the rows still unmatched, instead of
+merging and re-filtering the frames themselves. Missing values are a key
+value of their own, as in ``pd.merge``.
+
+Rows no key matches can go through ``blocked_match``, a fuzzy second stage
+that only compares rows sharing a block value such as the postal code.
+
+``registered_match`` keeps the pairs of a cascade on disk between runs, so a
+new release only matches the rows that are new or whose matched fields changed.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from dq.download import CACHE_DIR, write_parquet
+from dq.finess import normalize_street
+
+# ``left_on`` / ``right_on`` are the key columns of the rule on each side.
+Rule = namedtuple('Rule', ['name', 'left_on', 'right_on'])
+
+
+def column_codes(left, right, rules):
+    """Codes of every (left column, right column) pair the rules use, shared by both sides."""
+    codes = {}
+    for rule in rules:
+        for cols in zip(rule.left_on, rule.right_on):
+            if cols not in codes:
+                values = pd.concat([left[cols[0]], right[cols[1]]], ignore_index=True)
+                codes[cols] = pd.factorize(values, use_na_sentinel=False)
+    return codes
+
+
+def key_codes(codes, rule):
+    """Codes of the (multi-column) key of ``rule``, from its column codes."""
+    key = 0
+    for cols in zip(rule.left_on, rule.right_on):
+        col_codes, uniques = codes[cols]
+        # Re-factorizing keeps the combined codes below the row count.
+        key, _ = pd.factorize(key * len(uniques) + col_codes)
+    return key
+
+
+def cascade_match(left, right, rules, left_id, right_id):
+    """Pairs of ids matched by the first rule that matches them.
+
+    Rules are tried in order; once an id of either side is matched, its rows
+    take no part in the later rules. Returns one row per matched pair with
+    the ``left_id`` and ``right_id`` values and the ``rule`` name.
+    """
+    left_ids, left_uniques = pd.factorize(left[left_id], use_na_sentinel=False)
+    right_ids, right_uniques = pd.factorize(right[right_id], use_na_sentinel=False)
+    left_done = np.zeros(len(left_uniques), dtype=bool)
+    right_done = np.zeros(len(right_uniques), dtype=bool)
+
+    codes = column_codes(left, right, rules)
+    found = []
+    for rule in rules:
+        key = key_codes(codes, rule)
+        left_codes, right_codes = key[:len(left)], key[len(left):]
+        left_rows = np.flatnonzero(~left_done[left_ids])
+        right_rows = np.flatnonzero(~right_done[right_ids])
+        pairs = pd.merge(
+            pd.DataFrame({'key': left_codes[left_rows], 'left': left_ids[left_rows]}),
+            pd.DataFrame({'key': right_codes[right_rows], 'right': right_ids[right_rows]}),
+            on='key',
+        )[['left', 'right']].drop_duplicates()
+        left_done[pairs['left'].to_numpy()] = True
+        right_done[pairs['right'].to_numpy()] = True
+        found.append(pairs.assign(rule=rule.name))
+
+    pairs = pd.concat(found, ignore_index=True)
+    left_values = pd.Series(left_uniques, dtype=left[left_id].dtype)
+    right_values = pd.Series(right_uniques, dtype=right[right_id].dtype)
+    return pd.DataFrame({
+        left_id: left_values.array.take(pairs['left'].to_numpy()),
+        right_id: right_values.array.take(pairs['right'].to_numpy()),
+        'rule': pairs['rule'].to_numpy(),
+    })
+
+
+def match_report(matches, names, left_id, right_id):
+    """Matched ids and pairs per rule, in the order of ``names`` (rules that matched nothing show 0)."""
+    report = matches.groupby('rule', sort=False).agg(
+        **{left_id: (left_id, 'nunique'), right_id: (right_id, 'nunique'), 'pairs': ('rule', 'size')}
+    )
+    return report.reindex(names, fill_value=0).rename_axis('rule').reset_index()
+
+
+# ============================================================================
+# FUZZY MATCHING WITHIN BLOCKS
+# ============================================================================
+# ``left_on`` lists the candidate columns of one side (the best scoring one
+# counts), ``right_on`` is the column compared on the other side.
+Field = namedtuple('Field', ['left_on', 'right_on', 'weight'])
+
+
+def trigrams(text):
+    """(row, trigram code) pairs of a text column, one per distinct trigram of a row.
+
+    Text goes through ``normalize_street`` and is padded with a space on both
+    sides, so short words still give trigrams. Trigrams are built once per
+    distinct value.
+    """
+    codes, uniques = pd.factorize(text.fillna(''), use_na_sentinel=False)
+    words = normalize_street(pd.Series(uniques, dtype=object))
+    grams = [sorted({f" {w} "[i:i + 3] for i in range(len(w))}) if w else [] for w in words]
+    gram_codes, _ = pd.factorize(pd.Series([g for gs in grams for g in gs], dtype=object))
+    sizes = np.array([len(gs) for gs in grams], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    rows = np.repeat(np.arange(len(text)), sizes[codes])
+    offsets = np.repeat(starts[codes], sizes[codes])
+    within = np.arange(len(rows)) - np.repeat(np.cumsum(sizes[codes]) - sizes[codes], sizes[codes])
+    return rows, gram_codes[offsets + within], sizes[codes]
+
+
+def pair_similarity(left_text, right_text, left_rows, right_rows):
+    """Trigram Jaccard similarity of ``left_text[left_rows[k]]`` and ``right_text[right_rows[k]]``."""
+    text = pd.concat([pd.Series(left_text, dtype=object), pd.Series(right_text, dtype=object)],
+                     ignore_index=True)
+    rows, grams, sizes = trigrams(text)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    n_grams = np.int64(grams.max() + 1 if len(grams) else 1)
+
+    def expand(text_rows):
+        # One (pair, trigram) key per trigram of the row each pair points to.
+        counts = sizes[text_rows]
+        pair = np.repeat(np.arange(len(text_rows)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return pair * n_grams + grams[np.repeat(starts[text_rows], counts) + within]
+
+    # Keys are distinct on each side, so a key seen twice is a shared trigram.
+    keys = np.concatenate([expand(np.asarray(left_rows)),
+                           expand(np.asarray(right_rows) + len(left_text))])
+    keys.sort()
+    shared = keys[1:][keys[1:] == keys[:-1]]
+    common = np.bincount(shared // n_grams, minlength=len(left_rows))
+    union = sizes[np.asarray(left_rows)] + sizes[np.asarray(right_rows) + len(left_text)] - common
+    return np.divide(common, union, out=np.zeros(len(common)), where=union > 0)
+
+
+def blocked_match(left, right, left_block, right_block, fields, left_id, right_id, threshold=0.75):
+    """Fuzzy one-to-one matches of rows sharing a block value (e.g. the postal code).
+
+    Only pairs within a block are scored, so the cost follows the block sizes
+    rather than ``len(left) * len(right)``. The score is the weighted mean of
+    the field similarities (see ``pair_similarity``). Pairs scoring at least
+    ``threshold`` are accepted best score first, each id at most once.
+    Returns the ids and the ``score`` of the accepted pairs.
+    """
+    left_keys = left[left_block].fillna('')
+    right_keys = right[right_block].fillna('')
+    pairs = pd.merge(
+        pd.DataFrame({'block': left_keys.to_numpy(dtype=object), 'left': np.arange(len(left))})[left_keys.to_numpy() != ''],
+        pd.DataFrame({'block': right_keys.to_numpy(dtype=object), 'right': np.arange(len(right))})[right_keys.to_numpy() != ''],
+        on='block',
+    )
+    left_rows, right_rows = pairs['left'].to_numpy(), pairs['right'].to_numpy()
+
+    score = np.zeros(len(pairs))
+    for field in fields:
+        similarity = np.zeros(len(pairs))
+        for left_col in field.left_on:
+            similarity = np.maximum(similarity, pair_similarity(
+                left[left_col], right[field.right_on], left_rows, right_rows
+            ))
+        score += field.weight * similarity
+    score /= sum(field.weight for field in fields) or 1
+
+    score = score.round(3)
+    candidates = np.flatnonzero(score >= threshold)
+    candidates = candidates[np.argsort(-score[candidates], kind='stable')]
+    left_codes, _ = pd.factorize(left[left_id], use_na_sentinel=False)
+    right_codes, _ = pd.factorize(right[right_id], use_na_sentinel=False)
+    kept = candidates[best_first(left_codes[left_rows[candidates]], right_codes[right_rows[candidates]])]
+    return pd.DataFrame({
+        left_id: left[left_id].to_numpy()[left_rows[kept]],
+        right_id: right[right_id].to_numpy()[right_rows[kept]],
+        'score': score[kept],
+    })
+
+
+def best_first(left_codes, right_codes):
+    """Positions of the pairs kept, walking candidate pairs best first: a pair is
+    kept when neither its left nor its right id is taken yet.
+
+    ``left_codes`` / ``right_codes`` are the factorized ids of the candidates,
+    already sorted from the best score down.
+    """
+    left_taken = np.zeros(left_codes.max() + 1 if len(left_codes) else 0, dtype=bool)
+    right_taken = np.zeros(right_codes.max() + 1 if len(right_codes) else 0, dtype=bool)
+    kept = []
+    for k, (l, r) in enumerate(zip(left_codes.tolist(), right_codes.tolist())):
+        if not left_taken[l] and not right_taken[r]:
+            left_taken[l] = right_taken[r] = True
+            kept.append(k)
+    return np.array(kept, dtype=np.int64)
+
+
+# ============================================================================
+# MATCH REGISTRY
+# ============================================================================
+# Pairs accepted by a previous run, with the rule that matched them and a hash
+# of the fields each side had then. A pair is reused while both ids are still
+# there with the same fields; the other rows go through the cascade again.
+REGISTRY_DIR = CACHE_DIR / 'registry'
+
+
+def registry_path(name):
+    return REGISTRY_DIR / f"{name}.parquet"
+
+
+def field_hashes(df, id_col, columns):
+    """``id_col`` and a hash of its ``columns`` (missing values as ``''``), one row per id."""
+    values = df[columns].astype(object).where(df[columns].notna(), '').astype(str)
+    hashes = pd.DataFrame({
+        id_col: df[id_col].array,
+        'hash': pd.util.hash_pandas_object(values, index=False).to_numpy(),
+    }).dropna(subset=[id_col]).drop_duplicates()
+    # An id on several rows hashes all of them (the sum wraps around).
+    return hashes.groupby(id_col, sort=False)['hash'].sum().reset_index()
+
+
+def read_registry(name, left_id, right_id):
+    """Registered pairs of ``name``; empty when there is none yet or it is unreadable."""
+    columns = [left_id, right_id, 'rule', 'left_hash', 'right_hash']
+    path = registry_path(name)
+    if path.exists():
+        try:
+            registry = pd.read_parquet(path)
+            if list(registry.columns) == columns:
+                return registry
+        except (OSError, ValueError):
+            pass
+    return pd.DataFrame({
+        left_id: pd.Series(dtype='string'), right_id: pd.Series(dtype='string'),
+        'rule': pd.Series(dtype='string'),
+        'left_hash': pd.Series(dtype='uint64'), 'right_hash': pd.Series(dtype='uint64'),
+    })
+
+
+def write_registry(registry, name):
+    """Atomically replace the registry ``name``."""
+    write_parquet(registry, registry_path(name))
+
+
+def registered_match(left, right, rules, left_id, right_id, left_fields, right_fields, name):
+    """``cascade_match`` that reuses the pairs registered under ``name`` by earlier runs.
+
+    ``left_fields`` / ``right_fields`` are the columns whose change invalidates
+    a registered pair (typically every column the rules use). Rows of a reused
+    pair take no part in the cascade, which only runs on the new and changed
+    rows. The result has a ``reused`` column and becomes the new registry.
+    """
+    left_hashes = field_hashes(left, left_id, left_fields).rename(columns={'hash': 'left_hash'})
+    right_hashes = field_hashes(right, right_id, right_fields).rename(columns={'hash': 'right_hash'})
+
+    registry = read_registry(name, left_id, right_id)
+    registry = registry[registry['rule'].isin([rule.name for rule in rules])]
+    reused = (
+        registry.astype({left_id: left[left_id].dtype, right_id: right[right_id].dtype, 'rule': object})
+        .merge(left_hashes, on=[left_id, 'left_hash'])
+        .merge(right_hashes, on=[right_id, 'right_hash'])
+    )
+
+    fresh = cascade_match(
+        left[~left[left_id].isin(reused[left_id])],
+        right[~right[right_id].isin(reused[right_id])],
+        rules, left_id, right_id,
+    )
+    matches = pd.concat([
+        reused[[left_id, right_id, 'rule']].assign(reused=True),
+        fresh.assign(reused=False),
+    ], ignore_index=True)
+
+    write_registry(
+        matches[[left_id, right_id, 'rule']]
+        .merge(left_hashes, on=left_id)
+        .merge(right_hashes, on=right_id),
+        name,
+    )
+    return matches
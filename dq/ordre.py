@@ -0,0 +1,319 @@
+"""Annuaire of the Ordre national des pharmaciens: archive members and their columns.
+
+The annuaire is a ZIP of three ``;`` separated UTF-16 files (establishments,
+pharmacists, activities). Each member is transcoded to UTF-8 while it is
+streamed into the Arrow CSV reader, which parses on several threads; only the
+columns the pages use are read, all as text.
+
+``build_activity_index`` groups the activity rows by establishment and by
+pharmacist once per annuaire, so that the lookups of the pages (activities of
+a pharmacy, is this pharmacist active there) are array gathers and binary
+searches instead of fresh merges over the whole activities table.
+
+Each annuaire read is also kept as a snapshot (one Parquet file per table)
+named after its content digest and ``SNAPSHOT_VERSION``; ``annuaire_changes``
+compares a snapshot with the previous one of the same version and lists the
+records added, removed or changed in between.
+"""
+import codecs
+import io
+import shutil
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from dq.download import CACHE_DIR, write_parquet
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+ANNUAIRE_URL = "https://www.ordre.pharmacien.fr/download/annuaire_csv.zip"
+
+# Columns read from each member; the key is the word that identifies the
+# member in the archive file names.
+MEMBER_COLUMNS = {
+    'etablissements': [
+        "Numéro d'établissement", 'Type établissement', 'Dénomination commerciale',
+        'Raison sociale', 'Adresse', 'Code postal', 'Commune', 'Département', 'Région',
+        'Téléphone', 'Fax'
+    ],
+    'pharmaciens': ['n° RPPS', 'Prénom', 'Nom de naissance'],
+    'activites': ["Numéro d'établissement", 'n° RPPS pharmacien', 'Fonction'],
+}
+
+
+def find_member(zip_file, word):
+    """Name of the first archive member whose name contains ``word``."""
+    names = [name for name in zip_file.namelist() if word in name.lower()]
+    if not names:
+        raise ValueError(f"No '{word}' file in the annuaire archive")
+    return names[0]
+
+
+def member_encoding(zip_file, name):
+    """``utf-16`` when the member starts with a byte order mark (dropped on decoding), else ``utf-16-le``."""
+    with zip_file.open(name) as f:
+        head = f.read(2)
+    return 'utf-16' if head in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE) else 'utf-16-le'
+
+
+def read_member(zip_file, name, columns):
+    """``columns`` of an annuaire member as ``string`` columns, NA when empty."""
+    encoding = member_encoding(zip_file, name)
+    if pacsv is not None:
+        try:
+            with zip_file.open(name) as f:
+                table = pacsv.read_csv(
+                    f,
+                    read_options=pacsv.ReadOptions(encoding=encoding),
+                    parse_options=pacsv.ParseOptions(delimiter=';'),
+                    convert_options=pacsv.ConvertOptions(
+                        include_columns=columns,
+                        column_types=dict.fromkeys(columns, pa.string()),
+                        strings_can_be_null=True,
+                    ),
+                )
+            return table.to_pandas(types_mapper={pa.string(): pd.StringDtype()}.get)
+        except pa.ArrowInvalid:
+            # Ragged rows: the C parser below pads or reports them.
+            pass
+    with zip_file.open(name) as f:
+        return pd.read_csv(io.TextIOWrapper(f, encoding=encoding, newline=''), sep=';',
+                           usecols=columns, dtype='string', engine='c')
+
+
+def read_annuaire(zip_file):
+    """Establishments, pharmacists and activities tables of an annuaire archive."""
+    return tuple(
+        read_member(zip_file, find_member(zip_file, word), columns)
+        for word, columns in MEMBER_COLUMNS.items()
+    )
+
+
+# ============================================================================
+# ESTABLISHMENT <-> PHARMACIST INDEX
+# ============================================================================
+# Activity rows grouped CSR style, once per annuaire: the rows of the i-th
+# establishment are ``by_establishment[establishment_ptr[i]:establishment_ptr[i + 1]]``
+# in table order, and likewise for pharmacists. ``pair_order`` sorts the rows
+# by (establishment, rpps) and ``pair_keys`` holds their sorted pair keys.
+ActivityIndex = namedtuple('ActivityIndex', [
+    'size', 'establishments', 'rpps', 'by_establishment', 'establishment_ptr',
+    'by_rpps', 'rpps_ptr', 'pair_order', 'pair_keys'
+])
+
+
+def group_rows(codes, groups):
+    """Rows sorted by group code (table order within a group) and the group offsets."""
+    rows = np.flatnonzero(codes >= 0)
+    order = rows[np.argsort(codes[rows], kind='stable')]
+    ptr = np.zeros(groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes[rows], minlength=groups), out=ptr[1:])
+    return order, ptr
+
+
+def build_activity_index(activities, establishment_col="Numéro d'établissement",
+                         rpps_col='n° RPPS pharmacien'):
+    """``ActivityIndex`` of an activities table; rows are positions in that table."""
+    establishment_codes, establishments = pd.factorize(activities[establishment_col])
+    rpps_codes, rpps = pd.factorize(activities[rpps_col])
+    by_establishment, establishment_ptr = group_rows(establishment_codes, len(establishments))
+    by_rpps, rpps_ptr = group_rows(rpps_codes, len(rpps))
+
+    rows = np.flatnonzero((establishment_codes >= 0) & (rpps_codes >= 0))
+    keys = establishment_codes[rows].astype(np.int64) * len(rpps) + rpps_codes[rows]
+    sort = np.argsort(keys, kind='stable')
+    return ActivityIndex(
+        size=len(activities),
+        establishments=pd.Index(establishments, dtype=object),
+        rpps=pd.Index(rpps, dtype=object),
+        by_establishment=by_establishment,
+        establishment_ptr=establishment_ptr,
+        by_rpps=by_rpps,
+        rpps_ptr=rpps_ptr,
+        pair_order=rows[sort],
+        pair_keys=keys[sort],
+    )
+
+
+def lookup(values, uniques):
+    """Codes of ``values`` in an index of the ``ActivityIndex``, -1 when absent."""
+    return uniques.get_indexer(pd.Index(np.asarray(values, dtype=object)))
+
+
+def gather(order, starts, ends):
+    """``order[starts[k]:ends[k]]`` for every k, concatenated."""
+    counts = ends - starts
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order[np.repeat(starts, counts) + within]
+
+
+def group_bounds(ptr, codes):
+    """Offsets of the groups ``codes``; unknown codes get an empty range."""
+    starts, ends = ptr[codes], ptr[codes + 1]
+    starts[codes < 0] = ends[codes < 0] = 0
+    return starts, ends
+
+
+def pair_bounds(index, establishments, rpps):
+    """Range of ``pair_order`` holding each (establishment, rpps) pair."""
+    establishment_codes = lookup(establishments, index.establishments)
+    rpps_codes = lookup(rpps, index.rpps)
+    keys = np.where((establishment_codes >= 0) & (rpps_codes >= 0),
+                    establishment_codes.astype(np.int64) * len(index.rpps) + rpps_codes, -1)
+    return (np.searchsorted(index.pair_keys, keys, side='left'),
+            np.searchsorted(index.pair_keys, keys, side='right'))
+
+
+def establishment_rows(index, establishments):
+    """Activity rows of ``establishments``, establishment after establishment in order of
+    first appearance, each in table order."""
+    codes = lookup(pd.unique(np.asarray(establishments, dtype=object)), index.establishments)
+    return gather(index.by_establishment, *group_bounds(index.establishment_ptr, codes))
+
+
+def pair_rows(index, establishments, rpps):
+    """Activity rows of the given (establishment, rpps) pairs, sorted."""
+    return np.unique(gather(index.pair_order, *pair_bounds(index, establishments, rpps)))
+
+
+def row_mask(index, rows):
+    """Boolean mask over the activity rows, True at ``rows``."""
+    mask = np.zeros(index.size, dtype=bool)
+    mask[rows] = True
+    return mask
+
+
+def has_activity(index, establishments=None, rpps=None, rows=None):
+    """Whether each establishment, pharmacist or (establishment, rpps) pair has an activity.
+
+    Give ``establishments``, ``rpps`` or both, as aligned columns. ``rows`` is
+    an optional mask over the activity rows limiting the activities that count.
+    """
+    if rpps is None:
+        order = index.by_establishment
+        starts, ends = group_bounds(index.establishment_ptr, lookup(establishments, index.establishments))
+    elif establishments is None:
+        order = index.by_rpps
+        starts, ends = group_bounds(index.rpps_ptr, lookup(rpps, index.rpps))
+    else:
+        order = index.pair_order
+        starts, ends = pair_bounds(index, establishments, rpps)
+    if rows is None:
+        return ends > starts
+    counted = np.concatenate([[0], np.cumsum(rows[order])])
+    return counted[ends] > counted[starts]
+
+
+# ============================================================================
+# SNAPSHOTS AND RELEASE DIFF
+# ============================================================================
+SNAPSHOT_DIR = CACHE_DIR / 'ordre'
+KEEP_SNAPSHOTS = 3
+# Bump when the stored tables change (columns, cleaning): snapshots of other
+# versions are never compared and are dropped at the next save.
+SNAPSHOT_VERSION = 1
+
+# Record key of each table: a record whose key appears or disappears is added
+# or removed, one whose other columns differ is changed. Activities are keyed
+# on all their columns, so a move or a new role is a removal plus an addition.
+DIFF_KEYS = {
+    'etablissements': ["Numéro d'établissement"],
+    'pharmaciens': ['n° RPPS'],
+    'activites': ["Numéro d'établissement", 'n° RPPS pharmacien', 'Fonction'],
+}
+
+
+def snapshot_dir(digest):
+    return SNAPSHOT_DIR / f"v{SNAPSHOT_VERSION}-{digest[:16]}"
+
+
+def stored_dirs():
+    """Published snapshot directories of any version."""
+    if not SNAPSHOT_DIR.exists():
+        return []
+    return [d for d in SNAPSHOT_DIR.iterdir() if d.is_dir() and not d.name.endswith('.tmp')]
+
+
+def save_snapshot(tables, digest):
+    """Store the tables of ``read_annuaire`` as the snapshot of the annuaire ``digest``,
+    keeping the ``KEEP_SNAPSHOTS`` latest snapshots."""
+    target = snapshot_dir(digest)
+    if target.exists() or not write_parquet(dict(zip(MEMBER_COLUMNS, tables)), target):
+        return
+    current = list_snapshots()
+    for old in [d for d in stored_dirs() if d not in current] + current[:-KEEP_SNAPSHOTS]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def list_snapshots():
+    """Stored snapshot directories of ``SNAPSHOT_VERSION``, oldest first."""
+    prefix = f"v{SNAPSHOT_VERSION}-"
+    dirs = [d for d in stored_dirs() if d.name.startswith(prefix)]
+    return sorted(dirs, key=lambda d: d.stat().st_mtime)
+
+
+def load_snapshot(path):
+    return tuple(pd.read_parquet(path / f"{word}.parquet") for word in MEMBER_COLUMNS)
+
+
+def record_hashes(df, columns):
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def diff_table(old, new, key):
+    """Records of ``new`` added or changed since ``old`` and records of ``old`` removed,
+    matched on a hash of their ``key`` columns.
+
+    Returns the records (new values, old ones for removals) with a ``change``
+    column (``added``, ``removed``, ``changed``) and, for changes, the
+    ``changed_columns``. A key present several times counts its last record.
+    Only the columns of both tables are compared.
+    """
+    values = [col for col in new.columns if col in old.columns and col not in key]
+    codes, uniques = pd.factorize(np.concatenate([record_hashes(old, key), record_hashes(new, key)]))
+    old_at = np.full(len(uniques), -1)
+    new_at = np.full(len(uniques), -1)
+    old_at[codes[:len(old)]] = np.arange(len(old))
+    new_at[codes[len(old):]] = np.arange(len(new))
+
+    both = (old_at >= 0) & (new_at >= 0)
+    changed = np.zeros(len(uniques), dtype=bool)
+    if values:
+        changed[both] = record_hashes(old, values)[old_at[both]] != record_hashes(new, values)[new_at[both]]
+
+    old_changed = old.iloc[old_at[changed]].reset_index(drop=True)
+    new_changed = new.iloc[new_at[changed]].reset_index(drop=True)
+    differs = pd.DataFrame({
+        col: (old_changed[col].fillna('') != new_changed[col].fillna('')).to_numpy(dtype=bool)
+        for col in values
+    })
+    changed_columns = [', '.join(col for col, d in zip(values, row) if d) for row in differs.to_numpy()]
+
+    return pd.concat([
+        new.iloc[new_at[(new_at >= 0) & (old_at < 0)]].assign(change='added'),
+        old.iloc[old_at[(old_at >= 0) & (new_at < 0)]].assign(change='removed'),
+        new_changed.assign(change='changed', changed_columns=changed_columns),
+    ], ignore_index=True)
+
+
+def annuaire_changes(digest):
+    """``diff_table`` of every table between the snapshot ``digest`` and the previous
+    one, keyed like ``DIFF_KEYS``; None when there is no comparable previous snapshot
+    (missing, unreadable or without the key columns)."""
+    current = snapshot_dir(digest)
+    earlier = [d for d in list_snapshots() if d != current]
+    if not current.exists() or not earlier:
+        return None
+    try:
+        old_tables, new_tables = load_snapshot(earlier[-1]), load_snapshot(current)
+        return {
+            word: diff_table(old, new, DIFF_KEYS[word])
+            for word, old, new in zip(MEMBER_COLUMNS, old_tables, new_tables)
+        }
+    except (OSError, ValueError, KeyError):
+        return None
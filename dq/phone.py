@@ -0,0 +1,53 @@
+"""Phone numbers in one canonical form, shared by every page that shows or joins on them.
+
+The sources write numbers in many ways (``01 23 45 67 89``, ``01.23.45.67.89``,
+``123456789`` once the leading zero is lost, ``0033...``, ``+33 (0)1...``,
+floats out of a numeric column). ``normalize_phone`` turns a whole column into
+E.164 (``+33123456789``) with column string operations, so that two sources
+holding the same number hold the same value. Numbers without a country code
+are French, as everywhere in the TAM.
+"""
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    # The regular expressions below run as Arrow (RE2) kernels on these.
+    PHONE_DTYPE = 'string[pyarrow]'
+except ImportError:
+    PHONE_DTYPE = 'string'
+
+# Trunk zero or French country code (``+33``, ``0033``, ``33``, also with the
+# ``(0)`` some people write after it) in front of a nine-digit number.
+FRENCH_NUMBER = r'^(?:(?:\+|00)?33(?:0)?|0)?[1-9]\d{8}$'
+VALID_FRENCH = r'^\+33[1-9]\d{8}$'
+VALID_INTERNATIONAL = r'^\+[1-9]\d{7,14}$'
+# A number written out of a float: ``123456789.0``.
+FLOAT_TEXT = r'^\+?\d+\.0$'
+
+
+def normalize_phone(series):
+    """E.164 form of a column of phone numbers and whether each one is valid.
+
+    Returns two Series aligned on ``series``: the numbers (``string``, NA when
+    missing or empty) and a boolean flag. Numbers that cannot be made valid
+    still go through the same cleaning, so equal inputs stay equal.
+    """
+    # Identifiers read as numbers: 123456789.0 is 123456789, in a float column
+    # or as text (sheets and exports)
+    if pd.api.types.is_float_dtype(series):
+        series = series.round().astype('Int64')
+    # Numbers repeat (and are often missing): the string work runs on the
+    # distinct values, then broadcasts back.
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    text = pd.Series(uniques).astype(PHONE_DTYPE)
+    float_text = text.str.match(FLOAT_TEXT).fillna(False).to_numpy(dtype=bool)
+    text = text.where(~float_text, text.str.slice(0, -2))
+    text = text.str.replace(r'[^\d+]', '', regex=True)
+    # A French number is its last nine digits behind +33
+    french = text.str.match(FRENCH_NUMBER).fillna(False).to_numpy(dtype=bool)
+    text = text.where(~french, '+33' + text.str.slice(-9))
+    text = text.str.replace(r'^00', '+', regex=True)
+    text = text.mask(text == '')
+    valid = text.str.match(VALID_FRENCH) | (~text.str.startswith('+33') & text.str.match(VALID_INTERNATIONAL))
+    return (pd.Series(text.astype('string').array.take(codes), index=series.index),
+            pd.Series(valid.fillna(False).to_numpy(dtype=bool)[codes], index=series.index))
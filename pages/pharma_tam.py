@@ -1,13 +1,16 @@
 import streamlit as st
-import requests
 import zipfile
 import io
 import pandas as pd
 import numpy as np
-import re
-from datetime import datetime
-from pyproj import Transformer
-from bs4 import BeautifulSoup
+from dq.download import download, file_digest
+from dq.finess import TAM_COLUMNS, clean_finess, fetch_release, load_finess
+from dq.matching import Field, Rule, blocked_match, match_report, registered_match
+from dq.ordre import (
+    ANNUAIRE_URL, annuaire_changes, build_activity_index, establishment_rows, has_activity, pair_rows,
+    read_annuaire, row_mask, save_snapshot
+)
+from dq.phone import normalize_phone
 
 st.set_page_config(layout="wide")
 st.markdown("<h1 style='text-align: center;'>⚕️ TAM Pharma ⚕️</h1>", unsafe_allow_html=True)
@@ -18,73 +21,8 @@ st.write(' ')
 st.write(' ')
 
 # ============================================================================
-# PHARMACY ORDER DATA LOADING
+# CONSTANTS
 # ============================================================================
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def load_pharmacy_order_data():
-    """Load pharmacy order data from ZIP file with error handling."""
-    try:
-        url = "https://www.ordre.pharmacien.fr/download/annuaire_csv.zip"
-        response = requests.get(url, timeout=60)
-        response.raise_for_status()
-
-        # Load the ZIP file into a ZipFile object (from bytes, not disk)
-        zip_file = zipfile.ZipFile(io.BytesIO(response.content))
-
-        # Find files in the ZIP archive
-        pharmacy = [name for name in zip_file.namelist() if "etablissements" in name.lower()]
-        pharmacists = [name for name in zip_file.namelist() if "pharmaciens" in name.lower()]
-        pac = [name for name in zip_file.namelist() if "activites" in name.lower()]
-
-        if not pharmacy or not pharmacists or not pac:
-            raise ValueError("Required files not found in ZIP archive")
-
-        pharmacy_filename = pharmacy[0]
-        pharmacists_filename = pharmacists[0]
-        pac_filename = pac[0]
-
-        # Read CSV files from ZIP
-        with zip_file.open(pharmacy_filename) as ba:
-            pharmacies = pd.read_csv(
-                ba,
-                encoding="utf-16-le",
-                sep=";",
-                engine="python"
-            )
-
-        with zip_file.open(pharmacists_filename) as pa:
-            pharmacists_df = pd.read_csv(
-                pa,
-                encoding="utf-16-le",
-                sep=";",
-                engine="python"
-            )
-
-        with zip_file.open(pac_filename) as pacs:
-            activities = pd.read_csv(
-                pacs,
-                encoding="utf-16-le",
-                sep=";",
-                engine="python"
-            )
-
-        activities = activities.astype("string")
-        return pharmacies, pharmacists_df, activities
-    except Exception as e:
-        st.error(f"Error loading pharmacy order data: {str(e)}")
-        st.stop()
-
-pharmacies, pharmacists, activities = load_pharmacy_order_data()
-
-st.markdown("<h3 style='text-align: center;'> Order of Pharmacies </h3>", unsafe_allow_html=True)
-st.write(' ')
-
-# ============================================================================
-# PHARMACIES DATA CLEANING
-# ============================================================================
-pharmacies = pharmacies[pharmacies['Adresse'].notnull()]
-pharmacies = pharmacies.astype("string")
-
 types = [
     "OFFICINE",
     "SIEGE SOCIAL PHARMACEUTIQUE",
@@ -97,40 +35,6 @@ types = [
     "ANTENNE D'OFFICINE"
 ]
 
-# Clean phone numbers
-pharmacies['phone'] = pharmacies['Téléphone'].apply(
-    lambda x: '+33' + x[1:] if pd.notna(x) and x.startswith('0') else x
-)
-pharmacies = pharmacies.drop(columns='Téléphone', axis=1)
-
-# Clean addresses
-pharmacies["Adresse"] = pharmacies["Adresse"].str.replace(r' {2,}', ' ', regex=True)
-
-# Fix postal codes
-pharmacies['Code postal'] = pharmacies['Code postal'].apply(
-    lambda x: '0' + x if pd.notna(x) and len(x) == 4 else x
-)
-
-# Rename columns
-pharmacies.rename(
-    columns={
-        "Numéro d'établissement": 'numero_establishment',
-        'Type établissement': 'type',
-        'Dénomination commerciale': 'denomination_commerciale',
-        'Raison sociale': 'raison_sociale',
-        'Adresse': 'address',
-        'Code postal': 'code_postal',
-        'Département': 'department'
-    },
-    inplace=True
-)
-
-pharmacies = pharmacies[pharmacies['type'].isin(types)]
-pharmacists = pharmacists.astype("string")
-
-# ============================================================================
-# PHARMACISTS AND ACTIVITIES FILTERING
-# ============================================================================
 roles = [
     'PHARMACIEN TITULAIRE D\'OFFICINE',
     'ADJOINT INTERMITTENT EN OFFICINE',
@@ -153,171 +57,6 @@ roles = [
     'RESPONSABLE'
 ]
 
-activities = activities[activities["Numéro d'établissement"].isin(pharmacies['numero_establishment'].unique())]
-activities = activities[activities["Fonction"].isin(roles)]
-pharmacists = pharmacists[pharmacists['n° RPPS'].isin(activities['n° RPPS pharmacien'].unique())]
-pharmacists = pharmacists.rename(columns={"n° RPPS": 'rpps'})
-
-activities = activities.rename(
-    columns={
-        "Numéro d'établissement": 'numero_establishment',
-        "n° RPPS pharmacien": 'rpps'
-    }
-)
-
-# ============================================================================
-# DISPLAY PHARMACIES AND PHARMACISTS
-# ============================================================================
-col1, col2 = st.columns(2)
-with col1:
-    st.markdown(f'💊 Pharmacies: {len(pharmacies)}')
-    st.dataframe(pharmacies, width='stretch')
-with col2:
-    st.markdown('🥼 Pharmacists')
-    st.dataframe(pharmacists, width='stretch')
-st.write(' ')
-
-st.write('Activities')
-st.dataframe(activities)
-
-
-
-
-# ============================================================================
-# FINESS DATABASE LOADING
-# ============================================================================
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def load_finess_data():
-    """Load FINESS database data with error handling."""
-    try:
-        url = "https://www.data.gouv.fr/datasets/finess-extraction-du-fichier-des-etablissements/#_"
-        page = requests.get(url, timeout=60)
-        page.raise_for_status()
-        soup = BeautifulSoup(page.text, 'html.parser')
-        
-        download_div = soup.find('div', class_='flex items-center buttons')
-        if not download_div:
-            raise ValueError("Could not find download link on FINESS page")
-        
-        download_link = download_div.find('a')
-        if not download_link or 'href' not in download_link.attrs:
-            raise ValueError("Could not find download URL")
-        
-        filename = download_link['href']
-
-        headers = [
-            'section', 'numero_finess', 'numero_finess_juridique', 'raison_sociale',
-            'raison_sociale_long', 'raison_sociale_complement', 'distribution_complement',
-            'voie_numero', 'voie_type', 'voie_label', 'voie_complement', 'lieu_dit_bp',
-            'ville', 'departement', 'departement_label', 'ligne_acheminement', 'telephone',
-            'fax', 'code_categorie', 'label_categorie', 'code_status', 'label_status',
-            'siret', 'ape', 'code_tarif', 'label_tarif', 'code_psph',
-            'label_psph', 'date_ouverture', 'date_autor', 'date_update', 'num_uai'
-        ]
-
-        geoloc_names = [
-            'numero_finess', 'coord_x', 'coord_y', 'source_coord', 'date_update_coord'
-        ]
-
-        df = pd.read_csv(
-            filename,
-            sep=';',
-            skiprows=1,
-            header=None,
-            names=headers,
-            encoding='utf-8',
-            low_memory=False
-        )
-
-        df.drop(columns=['section'], inplace=True)
-
-        # Split data and geolocation
-        geoloc = df.iloc[int(len(df) / 2):].copy()
-        geoloc.drop(columns=geoloc.columns[5:], inplace=True)
-        geoloc.rename(
-            columns=lambda x: geoloc_names[list(df.columns).index(x)],
-            inplace=True
-        )
-
-        df = df.iloc[:int(len(df) / 2)].copy()
-        df['numero_finess'] = df['numero_finess'].astype("string")
-        geoloc['numero_finess'] = geoloc['numero_finess'].astype("string")
-        final = df.merge(geoloc, on='numero_finess', how='left')
-        
-        return final
-    except Exception as e:
-        st.error(f"Error loading FINESS data: {str(e)}")
-        st.stop()
-
-final = load_finess_data()
-
-# ============================================================================
-# FINESS DATA CLEANING
-# ============================================================================
-dico = {
-    'R': 'RUE', 'PL': 'PLACE', 'RTE': 'ROUTE', 'AV': 'AVENUE',
-    'GR': 'GRANDE RUE', 'ALL': 'ALLEE', 'CHE': 'CHEMIN', 'QUA': 'QUARTIER',
-    'BD': 'BOULEVARD', 'PROM': 'PROMENADE', 'ZA': 'ZONE ARTISANALE',
-    'QU': 'QUAI', 'ESPA': 'ESPACE', 'IMP': 'IMPASSE', 'LD': 'LIEU DIT',
-    'SQ': 'SQUARE', 'LOT': 'LOTISSEMENT',
-    'ZAC': "ZONE D'AMENAGEMENT CONCERTE", 'IMM': 'IMMEUBLE',
-    'RES': 'RESIDENCE', 'CRS': 'COURS', 'ESP': 'ESPLANADE', 'FG': 'FAUBOURG',
-    'CHS': 'CHAUSSEE', 'MTE': 'MONTEE', 'DOM': 'DOMAINE', 'PAS': 'PASSAGE',
-    'SEN': 'SENTIER', 'VAL': 'VALLEE', 'VOI': 'VOIE', 'PKG': 'PARKING',
-    'RLE': 'RUELLE'
-}
-
-final.replace({"voie_type": dico}, inplace=True)
-
-# Clean various fields
-final['raison_sociale'] = final['raison_sociale'].apply(
-    lambda x: str(x).replace('.0', '').replace('nan', '')
-)
-
-final['adresse'] = (
-    final['voie_numero'].apply(lambda x: str(x).replace('.0', '').replace('nan', '')) +
-    final['voie_complement'].apply(lambda x: str(x).replace('.0', '').replace('nan', '')) +
-    ' ' + final['voie_type'] + ' ' + final['voie_label']
-)
-
-final['code_postal'] = final['ligne_acheminement'].apply(
-    lambda x: str(re.search(r'\d\d\d\d\d|$', str(x))[0])
-)
-
-final['ville'] = final['ligne_acheminement'].apply(
-    lambda x: re.split(r'\d\d\d\d\d|$', str(x))[1].strip(' ')
-)
-
-final.rename(columns={"ligne_acheminement": "libelle_routage"}, inplace=True)
-
-final['telephone'] = final['telephone'].apply(
-    lambda x: ('+33' + str(x).replace('.0', '')).replace('+33nan', '')
-)
-
-final['fax'] = final['fax'].apply(
-    lambda x: ('+33' + str(x).replace('.0', '')).replace('+33nan', '')
-)
-
-final['siret'] = final['siret'].apply(
-    lambda x: str(x).replace('.0', '').replace('nan', '')
-)
-
-final['code_categorie'] = final['code_categorie'].apply(
-    lambda x: str(x).replace('.0', '').replace('nan', '')
-)
-
-final['code_status'] = final['code_status'].apply(
-    lambda x: str(x).replace('.0', '').replace('nan', '')
-)
-
-final['code_psph'] = final['code_psph'].apply(
-    lambda x: str(x).replace('.0', '').replace('nan', '')
-)
-
-final['ape'] = final['ape'].apply(
-    lambda x: str(x).replace(' ', '').replace('nan', '')
-)
-
 to_keep = [
     'numero_finess', 'siret', 'ape', 'raison_sociale', 'raison_sociale_long',
     'distribution_complement', 'adresse', 'lieu_dit_bp', 'code_postal', 'ville',
@@ -326,153 +65,42 @@ to_keep = [
     'numero_finess_juridique', 'coord_x', 'coord_y'
 ]
 
-final = final[to_keep]
-pharma = final[final['label_categorie'].str.contains('pharma', case=False)]
-
-st.write(' ')
-st.write(' ')
-st.write(' ')
-
-
-
-
-# ============================================================================
-# PHARMA DATA PREPARATION
-# ============================================================================
-pharma = pharma.astype("string")
-pharma = pharma[['numero_finess', 'raison_sociale', 'adresse', 'code_postal', 'telephone']]
-pharma['raison_sociale'] = pharma['raison_sociale'].str.strip()
-pharmacies['raison_sociale'] = pharmacies['raison_sociale'].str.strip()
-
-# ============================================================================
-# MERGE PHARMACIES WITH FINESS DATA
-# ============================================================================
-ba = pharmacies.copy()
-ba_0 = ba.copy()
-ba_0.rename(
-    columns={
-        'raison_sociale': 'name_in_order',
-        'code_postal': 'code_postal_in_order'
-    },
-    inplace=True
-)
-
-pharma_0 = pharma.copy()
-ba_0 = ba_0.astype("string")
-pharma_0 = pharma_0.astype("string")
-
-
-
-
-
-
-matched_ba_ids = set()
-matched_pharma_ids = set()
-
-# Merge 1: Full match (address, name, phone, postal code)
-merge1 = pd.merge(
-    ba_0, pharma_0,
-    left_on=['address', 'name_in_order', 'phone', 'code_postal_in_order'],
-    right_on=['adresse', 'raison_sociale', 'telephone', 'code_postal'],
-    suffixes=('_ba', '_pharma'),
-    how='inner'
-)
-
-matched_ba_ids.update(merge1['numero_establishment'])
-matched_pharma_ids.update(merge1['numero_finess'])
-
-# Merge 2: Match on address, name, postal code (no phone)
-ba_2 = ba_0[~ba_0['numero_establishment'].isin(matched_ba_ids)]
-pharma_2 = pharma_0[~pharma_0['numero_finess'].isin(matched_pharma_ids)]
-
-merge2 = pd.merge(
-    ba_2, pharma_2,
-    left_on=['address', 'name_in_order', 'code_postal_in_order'],
-    right_on=['adresse', 'raison_sociale', 'code_postal'],
-    suffixes=('_ba', '_pharma'),
-    how='inner'
-)
-
-matched_ba_ids.update(merge2['numero_establishment'])
-matched_pharma_ids.update(merge2['numero_finess'])
-
-# Merge 3: Match on address, commercial name, postal code
-ba_3 = ba_0[~ba_0['numero_establishment'].isin(matched_ba_ids)]
-pharma_3 = pharma_0[~pharma_0['numero_finess'].isin(matched_pharma_ids)]
-
-merge3 = pd.merge(
-    ba_3, pharma_3,
-    left_on=['address', 'denomination_commerciale', 'code_postal_in_order'],
-    right_on=['adresse', 'raison_sociale', 'code_postal'],
-    suffixes=('_ba', '_pharma'),
-    how='inner'
-)
-
-matched_ba_ids.update(merge3['numero_establishment'])
-matched_pharma_ids.update(merge3['numero_finess'])
-
-# Merge 4: Match on postal code and address
-ba_4 = ba_0[~ba_0['numero_establishment'].isin(matched_ba_ids)]
-pharma_4 = pharma_0[~pharma_0['numero_finess'].isin(matched_pharma_ids)]
-
-merge4 = pd.merge(
-    ba_4, pharma_4,
-    left_on=['code_postal_in_order', 'address'],
-    right_on=['code_postal', 'adresse'],
-    suffixes=('_ba', '_pharma'),
-    how='inner'
-)
-
-matched_ba_ids.update(merge4['numero_establishment'])
-matched_pharma_ids.update(merge4['numero_finess'])
-
-# Merge 5: Match on postal code and name
-ba_5 = ba_0[~ba_0['numero_establishment'].isin(matched_ba_ids)]
-pharma_5 = pharma_0[~pharma_0['numero_finess'].isin(matched_pharma_ids)]
-
-merge5 = pd.merge(
-    ba_5, pharma_5,
-    left_on=['code_postal_in_order', 'name_in_order'],
-    right_on=['code_postal', 'raison_sociale'],
-    suffixes=('_ba', '_pharma'),
-    how='inner'
-)
-
-matched_ba_ids.update(merge5['numero_establishment'])
-matched_pharma_ids.update(merge5['numero_finess'])
-
-# Merge 6: Match on postal code and commercial name
-ba_6 = ba_0[~ba_0['numero_establishment'].isin(matched_ba_ids)]
-pharma_6 = pharma_0[~pharma_0['numero_finess'].isin(matched_pharma_ids)]
-
-merge6 = pd.merge(
-    ba_6, pharma_6,
-    left_on=['code_postal_in_order', 'denomination_commerciale'],
-    right_on=['code_postal', 'raison_sociale'],
-    suffixes=('_ba', '_pharma'),
-    how='inner'
-)
-
-matched_ba_ids.update(merge6['numero_establishment'])
-matched_pharma_ids.update(merge6['numero_finess'])
-
-# Combine all merges
-final_merged = pd.concat([merge1, merge2, merge3, merge4, merge5, merge6], ignore_index=True)
-final_merged = final_merged.drop_duplicates()
-
+# Most specific key first; an establishment or FINESS matched by a rule is out
+# of the later ones.
+MATCH_RULES = [
+    Rule('Full (address, name, phone, postal code)',
+         ['address', 'raison_sociale', 'phone', 'code_postal'],
+         ['adresse', 'raison_sociale', 'telephone', 'code_postal']),
+    Rule('Address, name, postal code',
+         ['address', 'raison_sociale', 'code_postal'],
+         ['adresse', 'raison_sociale', 'code_postal']),
+    Rule('Address, commercial name, postal code',
+         ['address', 'denomination_commerciale', 'code_postal'],
+         ['adresse', 'raison_sociale', 'code_postal']),
+    Rule('Postal code, address',
+         ['code_postal', 'address'],
+         ['code_postal', 'adresse']),
+    Rule('Postal code, name',
+         ['code_postal', 'raison_sociale'],
+         ['code_postal', 'raison_sociale']),
+    Rule('Postal code, commercial name',
+         ['code_postal', 'denomination_commerciale'],
+         ['code_postal', 'raison_sociale']),
+]
 
-st.write(' ')
-st.write(' ')
-st.write(' ')
-st.write(' ')
+# Second stage: establishments no key matched are scored against the
+# unmatched FINESS of their postal code (name and address similarity).
+FUZZY_RULE = 'Fuzzy (postal code block)'
+FUZZY_FIELDS = [
+    Field(['raison_sociale', 'denomination_commerciale'], 'raison_sociale', 1),
+    Field(['address'], 'adresse', 1),
+]
 
-# ============================================================================
-# CREATE FINAL ORDER-FINESS MERGED DATASET
-# ============================================================================
-order_finess_pharmas = pharmacies.merge(
-    final_merged[['numero_establishment', 'numero_finess']],
-    how='left',
-    on='numero_establishment'
+# Fields whose change sends a registered pair back through the cascade.
+MATCH_REGISTRY = 'ordre_finess'
+REGISTRY_FIELDS = (
+    ['raison_sociale', 'denomination_commerciale', 'address', 'phone', 'code_postal'],
+    ['raison_sociale', 'adresse', 'telephone', 'code_postal'],
 )
 
 columns = [
@@ -481,45 +109,6 @@ columns = [
     "Région", "Fax", "phone"
 ]
 
-types = [
-    "OFFICINE",
-    "SIEGE SOCIAL PHARMACEUTIQUE",
-    "ETS C PHARMACEU. NON SIEGE SOCIAL",
-    "ETS B PHARMACEUT.NON SIEGE SOCIAL",
-    "PHARMACIEN MULTI - EMPLOYEURS",
-    "ETS BC PHARMACEU. NON SIEGE SOCIAL",
-    "PHARMACIE MUTUALISTE",
-    "PHARMACIE DE SECOURS MINIER",
-    "ANTENNE D'OFFICINE"
-]
-
-order_finess_pharmas = order_finess_pharmas[order_finess_pharmas['type'].isin(types)]
-order_finess_pharmas = order_finess_pharmas[columns]
-st.write(
-    f'💊 Order of Pharma with {len(list(order_finess_pharmas["numero_finess"].unique()))} '
-    f'matched finess accounts'
-)
-
-st.dataframe(order_finess_pharmas)
-
-# ============================================================================
-# PHARMACIES To add to gsheet
-# ============================================================================
-pharmacies_table = order_finess_pharmas.copy()
-
-# Filter to only include specific pharmacy types
-pharmacies_table = pharmacies_table[pharmacies_table['type'].isin(types)]
-
-# Rename columns to match requested format
-pharmacies_table = pharmacies_table.rename(columns={
-    'code_postal': 'postal_code',
-    'Commune': 'commune',
-    'Région': 'region',
-    'phone': 'telephone',
-    'Fax': 'fax'
-})
-
-# Select and reorder columns as requested
 pharmacies_table_columns = [
     'numero_establishment',
     'type',
@@ -534,67 +123,206 @@ pharmacies_table_columns = [
     'fax'
 ]
 
-# Check if all columns exist, create missing ones
-for col in pharmacies_table_columns:
-    if col not in pharmacies_table.columns:
-        pharmacies_table[col] = ''
+# ============================================================================
+# STAGES
+# ============================================================================
+# Each stage is cached on a fingerprint of its inputs: the digest of the
+# annuaire, the FINESS release URL, the fuzzy threshold and, for the
+# reconciliation, the content of the SF uploads. A rerun only recomputes the
+# stages whose inputs changed.
+@st.cache_data(ttl=3600, show_spinner=False)  # Cache for 1 hour
+def get_annuaire():
+    """Local mirror of the annuaire and the digest of its content."""
+    # Only re-downloaded when the annuaire changed upstream
+    path = download(ANNUAIRE_URL, 'ordre_annuaire')
+    return str(path), file_digest(path)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_release():
+    return fetch_release()
+
+
+@st.cache_data(max_entries=2, show_spinner="Loading the Ordre annuaire...")
+def build_order_tables(path, digest):
+    """Cleaned pharmacies, scoped pharmacists and activities of the annuaire with
+    content ``digest``, plus the activity index and the scope mask over its rows."""
+    with zipfile.ZipFile(path) as zip_file:
+        pharmacies, pharmacists, activities = read_annuaire(zip_file)
+    save_snapshot((pharmacies, pharmacists, activities), digest)
+    activity_index = build_activity_index(activities)
+
+    # Pharmacies cleaning
+    pharmacies = pharmacies[pharmacies['Adresse'].notnull()].copy()
+
+    # Clean phone numbers
+    pharmacies['phone'], _ = normalize_phone(pharmacies['Téléphone'])
+    pharmacies = pharmacies.drop(columns='Téléphone', axis=1)
+
+    # Clean addresses
+    pharmacies["Adresse"] = pharmacies["Adresse"].str.replace(r' {2,}', ' ', regex=True)
+
+    # Fix postal codes
+    pharmacies['Code postal'] = pharmacies['Code postal'].apply(
+        lambda x: '0' + x if pd.notna(x) and len(x) == 4 else x
+    )
 
-# Add 'level' column (empty for now, can be populated if needed)
-pharmacies_table['level'] = ''
+    # Rename columns
+    pharmacies.rename(
+        columns={
+            "Numéro d'établissement": 'numero_establishment',
+            'Type établissement': 'type',
+            'Dénomination commerciale': 'denomination_commerciale',
+            'Raison sociale': 'raison_sociale',
+            'Adresse': 'address',
+            'Code postal': 'code_postal',
+            'Département': 'department'
+        },
+        inplace=True
+    )
 
-# Select only the requested columns in the correct order
-pharmacies_table = pharmacies_table[pharmacies_table_columns + ['level']]
+    pharmacies = pharmacies[pharmacies['type'].isin(types)]
 
-st.write(' ')
-st.write(' ')
-st.markdown('### 📋 Pharmacies Table')
-st.dataframe(pharmacies_table, width='stretch')
-
-# ============================================================================
-# FILE UPLOADERS
-# ============================================================================
-current_tam = st.file_uploader("Upload the current TAM in SF as csv", type=["csv"])
-current_pharmacists = st.file_uploader("Upload the pharmacists in SF as csv", type=['csv'])
+    # Activities of the kept pharmacies with a kept role, as a mask over the
+    # annuaire activity rows (the index of `activities` keeps those positions)
+    in_scope = row_mask(activity_index, establishment_rows(activity_index, pharmacies['numero_establishment']))
+    in_scope &= activities["Fonction"].isin(roles).to_numpy()
+    activities = activities[in_scope]
+    pharmacists = pharmacists[has_activity(activity_index, rpps=pharmacists['n° RPPS'], rows=in_scope)]
+    pharmacists = pharmacists.rename(columns={"n° RPPS": 'rpps'})
 
+    activities = activities.rename(
+        columns={
+            "Numéro d'établissement": 'numero_establishment',
+            "n° RPPS pharmacien": 'rpps'
+        }
+    )
+    return pharmacies, pharmacists, activities, activity_index, in_scope
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def build_annuaire_changes(path, digest):
+    """Records added, removed or changed since the previous annuaire, per table (see dq.ordre)."""
+    # Stores the snapshot of this annuaire when it is new
+    build_order_tables(path, digest)
+    return annuaire_changes(digest)
+
+
+@st.cache_data(max_entries=2, show_spinner="Loading FINESS...")
+def build_pharma_finess(url):
+    """Pharmacies of the FINESS release at ``url``, with the columns used for matching."""
+    final = clean_finess(load_finess(url, TAM_COLUMNS))
+    final['numero_finess'] = final['numero_finess'].astype("string")
+    final = final[to_keep]
+    pharma = final[final['label_categorie'].str.contains('pharma', case=False)]
+
+    pharma = pharma.astype("string")
+    pharma = pharma[['numero_finess', 'raison_sociale', 'adresse', 'code_postal', 'telephone']]
+    pharma['raison_sociale'] = pharma['raison_sociale'].str.strip()
+    return pharma
+
+
+@st.cache_data(max_entries=4, show_spinner="Matching pharmacies with FINESS...")
+def match_pharmacies(path, digest, url, fuzzy_threshold):
+    """Ordre / FINESS matching of a given annuaire and release: report per rule,
+    fuzzy matches to review, merged dataset, pharmacies table and the number of
+    pairs reused from the match registry."""
+    pharmacies = build_order_tables(path, digest)[0]
+    pharmacies['raison_sociale'] = pharmacies['raison_sociale'].str.strip()
+    pharma = build_pharma_finess(url)
+
+    # Pairs confirmed by earlier releases are reused while neither side changed
+    final_merged = registered_match(
+        pharmacies.astype("string"), pharma.astype("string"), MATCH_RULES,
+        'numero_establishment', 'numero_finess', *REGISTRY_FIELDS, MATCH_REGISTRY
+    )
+    reused = int(final_merged.pop('reused').sum())
+    fuzzy_matches = blocked_match(
+        pharmacies[~pharmacies['numero_establishment'].isin(final_merged['numero_establishment'])],
+        pharma[~pharma['numero_finess'].isin(final_merged['numero_finess'])],
+        'code_postal', 'code_postal', FUZZY_FIELDS, 'numero_establishment', 'numero_finess',
+        threshold=fuzzy_threshold
+    )
+    final_merged = pd.concat([final_merged, fuzzy_matches.assign(rule=FUZZY_RULE)], ignore_index=True)
 
-def check_pac_status(row):
-    """Check if PAC status should be Active or Inactive based on RPPS presence."""
-    if row["pa_rpps"] in row["all_rpps_in_pharmacy"]:
-        return 'Active'
-    else:
-        return 'Inactive'
-    
+    report = match_report(
+        final_merged, [rule.name for rule in MATCH_RULES] + [FUZZY_RULE],
+        'numero_establishment', 'numero_finess'
+    )
+    fuzzy_review = (
+        fuzzy_matches
+        .merge(pharmacies[['numero_establishment', 'raison_sociale', 'denomination_commerciale',
+                           'address', 'code_postal']], on='numero_establishment')
+        .merge(pharma[['numero_finess', 'raison_sociale', 'adresse']], on='numero_finess',
+               suffixes=('_order', '_finess'))
+    )
 
-# ============================================================================
-# PROCESS UPLOADED FILES
-# ============================================================================
-if current_tam is not None and current_pharmacists is not None:
-    current_tam = pd.read_csv(current_tam)
-    current_pharmacists = pd.read_csv(current_pharmacists)
+    # Final Order-FINESS merged dataset
+    order_finess_pharmas = pharmacies.merge(
+        final_merged[['numero_establishment', 'numero_finess']],
+        how='left',
+        on='numero_establishment'
+    )
+    order_finess_pharmas = order_finess_pharmas[order_finess_pharmas['type'].isin(types)]
+    order_finess_pharmas = order_finess_pharmas[columns]
+
+    # Pharmacies to add to gsheet
+    pharmacies_table = order_finess_pharmas.copy()
+
+    # Filter to only include specific pharmacy types
+    pharmacies_table = pharmacies_table[pharmacies_table['type'].isin(types)]
+
+    # Rename columns to match requested format
+    pharmacies_table = pharmacies_table.rename(columns={
+        'code_postal': 'postal_code',
+        'Commune': 'commune',
+        'Région': 'region',
+        'phone': 'telephone',
+        'Fax': 'fax'
+    })
+
+    # Check if all columns exist, create missing ones
+    for col in pharmacies_table_columns:
+        if col not in pharmacies_table.columns:
+            pharmacies_table[col] = ''
+
+    # Add 'level' column (empty for now, can be populated if needed)
+    pharmacies_table['level'] = ''
+
+    # Select only the requested columns in the correct order
+    pharmacies_table = pharmacies_table[pharmacies_table_columns + ['level']]
+    return report, fuzzy_review, order_finess_pharmas, pharmacies_table, reused
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def reconcile_current_tam(path, digest, url, fuzzy_threshold, current_tam_bytes, current_pharmacists_bytes):
+    """PAC status updates and pharmacies, pharmacists and activities to create in SF;
+    cached on the upstream stage keys and the content of the two uploads."""
+    _, pharmacists, activities, activity_index, in_scope = build_order_tables(path, digest)
+    order_finess_pharmas = match_pharmacies(path, digest, url, fuzzy_threshold)[2]
+
+    current_tam = pd.read_csv(io.BytesIO(current_tam_bytes))
+    current_pharmacists = pd.read_csv(io.BytesIO(current_pharmacists_bytes))
     current_tam_w_rpps = current_tam[current_tam['pa_rpps'].notna()]
     current_tam_w_rpps['ba-pa'] = (
         current_tam_w_rpps['external_id'] + "-" + current_tam_w_rpps['pa_rpps']
     )
     pa_ba_combo = set(current_tam_w_rpps['ba-pa'].unique())
 
-    st.markdown(f"Current tam details: {len(current_tam['external_id'].unique())} accounts")
-
     # ========================================================================
     # UPDATE PAC STATUS FOR EXISTING PHARMACY-PHARMACIST COMBINATIONS
     # ========================================================================
-    rpps_per_estab = activities.groupby("numero_establishment")["rpps"].agg(list)
-    activities["all_rpps_in_pharmacy"] = activities["numero_establishment"].map(rpps_per_estab)
-
+    # PACs of pharmacies with activities in the Ordre: Active when the
+    # (pharmacy, pharmacist) pair is one of those activities, else Inactive.
     current_tam_pac = current_tam[current_tam['pa_rpps'].notna()]
-    pac_check_df = current_tam_pac[['external_id', 'pa_rpps', 'pac_id', 'pac_status']].merge(
-        activities[['numero_establishment', 'all_rpps_in_pharmacy', 'rpps']],
-        how='inner',
-        left_on=['external_id'],
-        right_on=['numero_establishment']
-    )
+    pac_check_df = current_tam_pac[
+        has_activity(activity_index, current_tam_pac['external_id'], rows=in_scope)
+    ][['external_id', 'pa_rpps', 'pac_id', 'pac_status']]
 
-    pac_check_df['new_status'] = pac_check_df.apply(check_pac_status, axis=1)
-    st.write('# Update current PACs status')
+    is_active = has_activity(
+        activity_index, pac_check_df['external_id'], pac_check_df['pa_rpps'], rows=in_scope
+    )
+    pac_check_df = pac_check_df.assign(new_status=np.where(is_active, 'Active', 'Inactive'))
     pac_status_change_df = pac_check_df[
         pac_check_df['pac_status'] != pac_check_df['new_status']
     ][['pac_id', 'new_status']].reset_index(drop=True)
@@ -605,34 +333,16 @@ if current_tam is not None and current_pharmacists is not None:
     )
     pac_status_change_df = pac_status_change_df.drop_duplicates()
 
-    st.dataframe(pac_status_change_df.reset_index(drop=True))
-    csv = pac_status_change_df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="📥   Download Updated PAC status ",
-        data=csv,
-        file_name=f'pac_status_update.csv',
-        mime='text/csv',
-    )
-
     # ========================================================================
     # FIND MISSING ACTIVITIES
     # ========================================================================
-    missing_activities_current_tam = (
-        activities[['numero_establishment', 'rpps', 'Fonction']].merge(
-            current_tam[['external_id', 'pa_rpps']],
-            how='left',
-            left_on=['numero_establishment', 'rpps'],
-            right_on=['external_id', 'pa_rpps']
-        )
-    )
-
-    missing_activities_current_tam = missing_activities_current_tam[
-        (missing_activities_current_tam['numero_establishment'].isin(
-            current_tam['external_id'].unique()
-        ))
-        & (missing_activities_current_tam['external_id'].isna())
+    # Activities of the pharmacies in SF whose (pharmacy, pharmacist) pair has no PAC
+    in_current_tam = row_mask(activity_index, establishment_rows(activity_index, current_tam['external_id']))
+    with_pac = row_mask(activity_index, pair_rows(activity_index, current_tam['external_id'], current_tam['pa_rpps']))
+    missing_activities_current_tam = activities[
+        (in_current_tam & ~with_pac)[activities.index]
     ][['numero_establishment', 'rpps', 'Fonction']]
-    
+
     # ========================================================================
     # FIND MISSING PHARMACIES
     # ========================================================================
@@ -660,8 +370,6 @@ if current_tam is not None and current_pharmacists is not None:
     missing_pharmacies = missing_pharmacies.drop(columns='Fax', axis=1)
 
     pharmacies_to_create = missing_pharmacies.copy().drop_duplicates()
-    st.write(' ')
-    st.write(f'## Missing pharmacies to create: {len(pharmacies_to_create)}')
     pharmacies_to_create.rename(
         columns={
             'numero_establishment': 'external_id',
@@ -683,33 +391,13 @@ if current_tam is not None and current_pharmacists is not None:
     pharmacies_to_create['billingcountrycode'] = 'FR'
     pharmacies_to_create = pharmacies_to_create.drop_duplicates()
 
-    st.dataframe(pharmacies_to_create.reset_index(drop=True))
-    csv = pharmacies_to_create.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="📥   Download pharmacies to create ",
-        data=csv,
-        file_name=f'new_pharma_ba.csv',
-        mime='text/csv',
-    )
-
     # ========================================================================
     # FIND MISSING PHARMACISTS
     # ========================================================================
-    missing_pharmacies = missing_pharmacies.merge(
-        activities,
-        how='left',
-        left_on='numero_establishment',
-        right_on='numero_establishment'
-    )
-
-    missing_pharmacies = missing_pharmacies.merge(
-        pharmacists,
-        how='left',
-        left_on='rpps',
-        right_on='rpps'
-    )
-
-    missing_activities = missing_pharmacies[['numero_establishment', 'rpps', 'Fonction']].drop_duplicates()
+    missing_rows = establishment_rows(activity_index, missing_pharmacies['numero_establishment'])
+    missing_activities = activities.loc[
+        missing_rows[in_scope[missing_rows]], ['numero_establishment', 'rpps', 'Fonction']
+    ].drop_duplicates()
     missing_activities = pd.concat([missing_activities, missing_activities_current_tam])
     missing_activities = missing_activities.drop_duplicates()
 
@@ -742,23 +430,11 @@ if current_tam is not None and current_pharmacists is not None:
         inplace=True
     )
     pharmacists_to_create['specialty__c'] = 'a0h1i000000niyxAAA'
-
-    st.write('## Pharmacists to create: ')
     pharmacists_to_create = pharmacists_to_create.drop_duplicates()
-    st.dataframe(pharmacists_to_create.reset_index(drop=True))
-    csv = pharmacists_to_create.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="📥   Download pharmacists to create ",
-        data=csv,
-        file_name=f'new_pharmacists_pa.csv',
-        mime='text/csv',
-    )
 
     # ========================================================================
     # FIND MISSING ACTIVITIES
     # ========================================================================
-    st.write(' ')
-    st.write('## Activities to create: ')
     missing_activities.rename(
         columns={
             'numero_establishment': 'external_id',
@@ -783,8 +459,158 @@ if current_tam is not None and current_pharmacists is not None:
         suffixes=('', '_pharmacy')
     )
     missing_activities.rename(columns={'id': 'businessaccount_id'}, inplace=True)
-
     missing_activities = missing_activities.drop_duplicates()
+
+    accounts = len(current_tam['external_id'].unique())
+    return accounts, pac_status_change_df, pharmacies_to_create, pharmacists_to_create, missing_activities
+
+
+# ============================================================================
+# PHARMACY ORDER DATA LOADING
+# ============================================================================
+try:
+    annuaire_path, annuaire_digest = get_annuaire()
+    pharmacies, pharmacists, activities, activity_index, in_scope = build_order_tables(
+        annuaire_path, annuaire_digest
+    )
+except Exception as e:
+    st.error(f"Error loading pharmacy order data: {str(e)}")
+    st.stop()
+
+st.markdown("<h3 style='text-align: center;'> Order of Pharmacies </h3>", unsafe_allow_html=True)
+st.write(' ')
+
+# ============================================================================
+# DISPLAY PHARMACIES AND PHARMACISTS
+# ============================================================================
+col1, col2 = st.columns(2)
+with col1:
+    st.markdown(f'💊 Pharmacies: {len(pharmacies)}')
+    st.dataframe(pharmacies, width='stretch')
+with col2:
+    st.markdown('🥼 Pharmacists')
+    st.dataframe(pharmacists, width='stretch')
+st.write(' ')
+
+st.write('Activities')
+st.dataframe(activities)
+
+# ============================================================================
+# CHANGES SINCE THE PREVIOUS ANNUAIRE
+# ============================================================================
+st.write(' ')
+st.markdown('🗓️ Changes since the previous annuaire')
+changes = build_annuaire_changes(annuaire_path, annuaire_digest)
+if changes is None:
+    st.caption('No comparable previous annuaire stored yet: changes are listed from the next release on.')
+else:
+    tabs = st.tabs(['Pharmacies', 'Pharmacists', 'Activities'])
+    for tab, diff in zip(tabs, changes.values()):
+        with tab:
+            counts = diff['change'].value_counts()
+            st.markdown(
+                f"{counts.get('added', 0)} added, {counts.get('removed', 0)} removed, "
+                f"{counts.get('changed', 0)} changed"
+            )
+            st.dataframe(diff, width='stretch')
+
+# ============================================================================
+# FINESS DATABASE LOADING
+# ============================================================================
+try:
+    url, _ = get_release()
+    build_pharma_finess(url)
+except Exception as e:
+    st.error(f"Error loading FINESS data: {str(e)}")
+    st.stop()
+
+st.write(' ')
+st.write(' ')
+st.write(' ')
+
+# ============================================================================
+# MATCH PHARMACIES WITH FINESS DATA
+# ============================================================================
+fuzzy_threshold = st.slider('Fuzzy match threshold', min_value=0.5, max_value=1.0, value=0.8, step=0.05)
+report, fuzzy_review, order_finess_pharmas, pharmacies_table, reused = match_pharmacies(
+    annuaire_path, annuaire_digest, url, fuzzy_threshold
+)
+
+st.markdown(f'🔗 Order / FINESS matches per rule ({reused} pairs reused from earlier releases)')
+st.dataframe(report)
+
+st.markdown(f'🔍 Fuzzy matches to review: {len(fuzzy_review)}')
+st.dataframe(fuzzy_review, width='stretch')
+
+
+st.write(' ')
+st.write(' ')
+st.write(' ')
+st.write(' ')
+
+st.write(
+    f'💊 Order of Pharma with {len(list(order_finess_pharmas["numero_finess"].unique()))} '
+    f'matched finess accounts'
+)
+
+st.dataframe(order_finess_pharmas)
+
+st.write(' ')
+st.write(' ')
+st.markdown('### 📋 Pharmacies Table')
+st.dataframe(pharmacies_table, width='stretch')
+
+
+# ============================================================================
+# PROCESS UPLOADED FILES
+# ============================================================================
+@st.fragment
+def current_tam_section():
+    # Runs on its own: uploading or downloading only reruns this block.
+    current_tam = st.file_uploader("Upload the current TAM in SF as csv", type=["csv"])
+    current_pharmacists = st.file_uploader("Upload the pharmacists in SF as csv", type=['csv'])
+    if current_tam is None or current_pharmacists is None:
+        return
+
+    accounts, pac_status_change_df, pharmacies_to_create, pharmacists_to_create, missing_activities = \
+        reconcile_current_tam(annuaire_path, annuaire_digest, url, fuzzy_threshold,
+                              current_tam.getvalue(), current_pharmacists.getvalue())
+
+    st.markdown(f"Current tam details: {accounts} accounts")
+
+    st.write('# Update current PACs status')
+    st.dataframe(pac_status_change_df.reset_index(drop=True))
+    csv = pac_status_change_df.to_csv(index=False).encode('utf-8')
+    st.download_button(
+        label="📥   Download Updated PAC status ",
+        data=csv,
+        file_name=f'pac_status_update.csv',
+        mime='text/csv',
+    )
+
+    st.write(' ')
+    st.write(f'## Missing pharmacies to create: {len(pharmacies_to_create)}')
+    st.dataframe(pharmacies_to_create.reset_index(drop=True))
+    csv = pharmacies_to_create.to_csv(index=False).encode('utf-8')
+    st.download_button(
+        label="📥   Download pharmacies to create ",
+        data=csv,
+        file_name=f'new_pharma_ba.csv',
+        mime='text/csv',
+    )
+
+    st.write('## Pharmacists to create: ')
+    st.dataframe(pharmacists_to_create.reset_index(drop=True))
+    csv = pharmacists_to_create.to_csv(index=False).encode('utf-8')
+    st.download_button(
+        label="📥   Download pharmacists to create ",
+        data=csv,
+        file_name=f'new_pharmacists_pa.csv',
+        mime='text/csv',
+    )
+
+    st.write(' ')
+    st.write('## Activities to create: ')
     st.dataframe(missing_activities.drop('ba-pa', axis=1).reset_index(drop=True))
     csv = missing_activities.to_csv(index=False).encode('utf-8')
     st.download_button(
@@ -796,3 +622,4 @@ if current_tam is not None and current_pharmacists is not None:
     st.write(' ')
 
 
+current_tam_section()
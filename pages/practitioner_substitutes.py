@@ -4,6 +4,7 @@ import zipfile
 import io
 import pandas as pd
 from datetime import datetime
+from dq.phone import normalize_phone
 
 today_date= datetime.today().strftime("%d-%m-%Y")
 
@@ -45,23 +46,9 @@ if df_file and specs_file and agendas_file:
         st.error(f"❌ Missing columns in agendas file: {', '.join(missing_agendas)}")
         st.stop()
     
-    def format_phone_number(phone_number):
-        if pd.isna(phone_number):  
-            return phone_number
-        phone_number = str(phone_number).replace('.', '').replace(' ', '')
-
-        if phone_number.startswith(("06", "07", "01", "02", "03", "04", "05")):
-            phone_number = "+33" + phone_number[1:]
-        elif phone_number.startswith(("6", "7", "1", "2", "3", "4", "5")):
-            phone_number = "+33" + phone_number  
-        elif phone_number.startswith(("+33")):
-            phone_number =  phone_number 
-        elif phone_number.startswith(("33")):
-            phone_number =  "+" + phone_number 
-        return phone_number
-    
-    df['phone_number'] = df['phone_number'].apply(format_phone_number)
-    specs['phone'] = specs['phone'].apply(format_phone_number)
+    # Same E.164 form on both sides; only valid numbers join (below)
+    df['phone_number'], df_phone_valid = normalize_phone(df['phone_number'])
+    specs['phone'], specs_phone_valid = normalize_phone(specs['phone'])
 
     df['name'] = df['first_name'] + ' ' + df['last_name']
     df['name'] = df['name'].str.lower()
@@ -107,10 +94,10 @@ if df_file and specs_file and agendas_file:
     count_merged_email = len(merged_email)
 
     # Create clean DataFrames with phone columns already converted to string
-    specs_clean = specs.dropna(subset=['phone_metabase']).copy()
+    specs_clean = specs[specs_phone_valid[specs.index]].copy()
     specs_clean = specs_clean.assign(phone_metabase=specs_clean['phone_metabase'].astype(str))
     
-    df_clean = df.dropna(subset=['phone_sheet']).copy()
+    df_clean = df[df_phone_valid[df.index]].copy()
     df_clean = df_clean.assign(phone_sheet=df_clean['phone_sheet'].astype(str))
 
     merged_phone = specs_clean.merge(
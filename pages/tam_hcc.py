@@ -2,11 +2,10 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import re
+import io
 from datetime import datetime
-from pyproj import Transformer
-from bs4 import BeautifulSoup
-import requests
+from dq.finess import TAM_COLUMNS, clean_finess, fetch_release, load_finess
+from dq.geo import to_lonlat
 
 
 mapping = {
@@ -39,84 +38,38 @@ mapping = {
 }
 
 st.markdown("<h1 style='text-align: center;'>🏢 TAM HCC 🏢</h1>", unsafe_allow_html=True)
-url="https://www.data.gouv.fr/datasets/finess-extraction-du-fichier-des-etablissements/#_"
-page=requests.get(url, timeout=60)
-soup=BeautifulSoup(page.text, 'html.parser')
-url=soup.find('div',class_='flex items-center buttons').find('a')['href']
-filename = url
-
-headers = [
-    'section','numero_finess','numero_finess_juridique','raison_sociale',
-    'raison_sociale_long','raison_sociale_complement','distribution_complement',
-    'voie_numero','voie_type','voie_label','voie_complement','lieu_dit_bp',
-    'ville','departement','departement_label','ligne_acheminement','telephone',
-    'fax','code_categorie','label_categorie','code_status','label_status',
-    'siret','ape','code_tarif','label_tarif','code_psph',
-    'label_psph','date_ouverture','date_autor','date_update','num_uai'
-]
-geoloc_names = [
-    'numero_finess','coord_x','coord_y','source_coord','date_update_coord'
-]
 
-# upload the csv
-
-df = pd.read_csv(filename,sep=';', skiprows=1, header=None, names=headers,
-                encoding='utf-8', low_memory=False)
-df.drop(columns=['section'], inplace=True)
-geoloc = df.iloc[int(len(df)/2):].copy()
-geoloc.drop(columns=geoloc.columns[5:], inplace=True)
-geoloc.rename(columns=lambda x: geoloc_names[list(df.columns).index(x)], inplace=True)
-df = df.iloc[:int(len(df)/2)].copy()
-df['numero_finess'] = df['numero_finess'].astype(str)
-geoloc['numero_finess'] = geoloc['numero_finess'].astype(str)
-final = df.merge(geoloc, on='numero_finess', how='left')
-dico={'R':'RUE', 'PL':'PLACE', 'RTE':'ROUTE', 'AV':'AVENUE', 'GR':'GRANDE RUE', 'ALL':'ALLEE', 'CHE':'CHEMIN', 'QUA':'QUARTIER',
-'BD':'BOULEVARD', 'PROM':'PROMENADE', 'ZA':'ZONE ARTISANALE', 'QU':'QUAI', 'ESPA':'ESPACE', 'IMP':'IMPASSE', 'LD':'LIEU DIT', 'SQ':'SQUARE',
- 'LOT':'LOTISSEMENT', 'ZAC':"ZONE D'AMENAGEMENT CONCERTE", 'IMM':'IMMEUBLE', 'RES':'RESIDENCE', 'CRS':'COURS', 'ESP':'ESPLANADE', 'FG':'FAUBOURG',
-'CHS':'CHAUSSEE', 'MTE':'MONTEE', 'DOM':'DOMAINE', 'PAS':'PASSAGE', 'SEN':'SENTIER', 'VAL':'VALLEE', 'VOI':'VOIE',
-'PKG':'PARKING', 'RLE':'RUELLE'}
-final.replace({"voie_type": dico},inplace=True)
-final['raison_sociale']=final['raison_sociale'].apply(lambda x : str(x).replace('.0','').replace('nan',''))
-final['adresse']=final['voie_numero'].apply(lambda x : str(x).replace('.0','').replace('nan',''))+final['voie_complement'].apply(lambda x : str(x).replace('.0','').replace('nan',''))+ ' ' + final['voie_type'] + ' ' + final['voie_label']
-final['code_postal']=final['ligne_acheminement'].apply(lambda x: str(re.search(r'\d\d\d\d\d|$',str(x))[0]))
-final['ville']=final['ligne_acheminement'].apply(lambda x: re.split(r'\d\d\d\d\d|$',str(x))[1].strip(' '))
-final.rename(columns={"ligne_acheminement": "libelle_routage"},inplace=True)
-final['telephone']=final['telephone'].apply(lambda x : ('+33' + str(x).replace('.0','')).replace('+33nan',''))
-final['fax']=final['fax'].apply(lambda x : ('+33' + str(x).replace('.0','')).replace('+33nan',''))
-final['siret']=final['siret'].apply(lambda x : str(x).replace('.0','').replace('nan',''))
-final['code_categorie']=final['code_categorie'].apply(lambda x : str(x).replace('.0','').replace('nan',''))
-final['code_status']=final['code_status'].apply(lambda x : str(x).replace('.0','').replace('nan',''))
-final['code_psph']=final['code_psph'].apply(lambda x : str(x).replace('.0','').replace('nan',''))
-final['ape']=final['ape'].apply(lambda x : str(x).replace(' ','').replace('nan',''))
-to_keep=['numero_finess','siret','ape','raison_sociale','raison_sociale_long','distribution_complement','adresse','lieu_dit_bp','code_postal','ville','telephone','fax','code_categorie','label_categorie','code_status','label_status','code_psph','date_ouverture','date_update','num_uai','numero_finess_juridique','coord_x','coord_y']
-final_scope=final[to_keep].copy()
-
-scope= [
-    "124", "142", "143", "197", "223", "224", "228", "230", 
-    "266", "267", "268", "269", "270", "294", "347", "438", 
-    "616", "630", "636", "637", "638", "645", "125", "130", 
-    "289", "439"
-]
-final_scope=final_scope[final_scope['code_categorie'].isin(scope)].copy()
-preventif= ["142", "143", "197", "223", "224", "228", "230", "266", "267", "268", 
-                     "269", "270", "294", "347", "438", "616", "636", "637", "638", "645"]
-curatif=["124","125","130","289","439","630"]
-final_scope.loc[final_scope['code_categorie'].isin(preventif),'orga_type']='PREVENTION'
-final_scope.loc[final_scope['code_categorie'].isin(curatif),'orga_type']='CURATIVE'
-final_scope['organization_type']=final_scope['code_categorie'].astype(str).map(mapping).fillna('OTHER')
-
-final_scope['status']='open'
-final_scope['closed_at']=np.nan
-final_scope['new_establishment_this_month']=False
-final_scope['coord_x'] = final_scope['coord_x'].replace(",", ".")
-final_scope['coord_y'] = final_scope['coord_y']
-transformer = Transformer.from_crs("EPSG:2154", "EPSG:4326", always_xy=True)
-
-final_scope[["longitude", "lattitude"]] = final_scope.apply(
-    lambda row: pd.Series(transformer.transform(row['coord_x'], row['coord_y'])),
-    axis=1
-)
-new_tam=final_scope.copy()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_release():
+    return fetch_release()
+
+
+@st.cache_data(max_entries=2, show_spinner="Loading FINESS...")
+def build_hcc_tam(url):
+    """Cleaned and geolocated HCC scope of the FINESS release at ``url``."""
+    scope= [
+        "124", "142", "143", "197", "223", "224", "228", "230", 
+        "266", "267", "268", "269", "270", "294", "347", "438", 
+        "616", "630", "636", "637", "638", "645", "125", "130", 
+        "289", "439"
+    ]
+    final = clean_finess(load_finess(url, TAM_COLUMNS + ['source_coord'], categories=scope))
+    to_keep=['numero_finess','siret','ape','raison_sociale','raison_sociale_long','distribution_complement','adresse','lieu_dit_bp','code_postal','ville','telephone','fax','code_categorie','label_categorie','code_status','label_status','code_psph','date_ouverture','date_update','num_uai','numero_finess_juridique','coord_x','coord_y']
+    final_scope=final[to_keep].copy()
+    preventif= ["142", "143", "197", "223", "224", "228", "230", "266", "267", "268", 
+                         "269", "270", "294", "347", "438", "616", "636", "637", "638", "645"]
+    curatif=["124","125","130","289","439","630"]
+    final_scope.loc[final_scope['code_categorie'].isin(preventif),'orga_type']='PREVENTION'
+    final_scope.loc[final_scope['code_categorie'].isin(curatif),'orga_type']='CURATIVE'
+    final_scope['organization_type']=final_scope['code_categorie'].astype(str).map(mapping).fillna('OTHER')
+
+    final_scope['status']='open'
+    final_scope['closed_at']=np.nan
+    final_scope['new_establishment_this_month']=False
+    final_scope["longitude"], final_scope["lattitude"] = to_lonlat(final['coord_x'], final['coord_y'], final['source_coord'])
+    return final_scope
+
 
 gsheet_columns= [
     "numero_finess", "numero_finess_juridique", "raison_sociale", "raison_sociale_long",
@@ -134,8 +87,37 @@ opps_columns = [
     "healthcareservice type", "orga type", "siret", "label_categorie",
     "label_status", "date_ouverture", "date_update", "numero_finess_juridique"
 ]
-text = soup.find('div', class_='flex items-center fr-mb-1v')
-date=text.find('span').find('div').get('text')[-11:-1]
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def reconcile_current_tam(url, current_tam_bytes):
+    """Diff the uploaded SF TAM against the release; cached on the release URL and file content."""
+    new_tam=build_hcc_tam(url)
+    current_tam = pd.read_csv(io.BytesIO(current_tam_bytes))
+
+    new_tam_finess=set(new_tam['numero_finess'].unique())
+    current_tam_finess=set(current_tam['numero_finess'].unique())
+    new_finess=new_tam_finess - current_tam_finess
+
+    new_tam.loc[new_tam['numero_finess'].isin(list(new_finess)),'new_establishment_this_month']=True
+    new_accounts=new_tam[new_tam['numero_finess'].isin(list(new_finess))]
+
+    new_accounts_modified=new_accounts.copy()
+    new_accounts_modified.rename(columns={'numero_finess':'finessnumber__c','raison_sociale':'name','telephone':'phone','orga_type':'healthcareservice type','organization_type':'orga type'},inplace=True)
+    new_accounts_modified=new_accounts_modified[opps_columns]
+
+    import_gsheet=current_tam[gsheet_columns].copy()
+    import_gsheet['new_establishment_this_month']=False
+    new_accounts=new_accounts[gsheet_columns]
+    import_gsheet = pd.concat([import_gsheet, new_accounts], ignore_index=True)
+
+    csv = new_accounts_modified.to_csv(index=False).encode('utf-8')
+    csv_import_gsheet = import_gsheet.to_csv(index=False).encode('utf-8')
+    return current_tam, new_finess, new_accounts_modified, import_gsheet, csv, csv_import_gsheet
+
+
+url, date = get_release()
+new_tam = build_hcc_tam(url)
 today_date= datetime.today().strftime("%d-%m-%Y")
 accounts_in_tam=len(new_tam['numero_finess'].unique())
 st.markdown(f'## TAM on {date}:')
@@ -147,26 +129,21 @@ st.dataframe(new_tam)
 st.markdown("<hr style='border:2px solid #000;'>", unsafe_allow_html=True)
 
 
-current_tam = st.file_uploader("Upload the current TAM in SF as csv", type=["csv"])
-if current_tam is not None:
-    current_tam = pd.read_csv(current_tam)
+@st.fragment
+def current_tam_section():
+    # Runs on its own: uploading or downloading only reruns this block.
+    current_tam = st.file_uploader("Upload the current TAM in SF as csv", type=["csv"])
+    if current_tam is None:
+        return
+
+    current_tam, new_finess, new_accounts_modified, import_gsheet, csv, csv_import_gsheet = \
+        reconcile_current_tam(url, current_tam.getvalue())
     st.markdown(f'Current tam details: {len(current_tam)} accounts')
-    st.dataframe(current_tam)  
-    
-    new_tam_finess=set(new_tam['numero_finess'].unique())
-    current_tam_finess=set(current_tam['numero_finess'].unique())
-    new_finess=new_tam_finess - current_tam_finess
-    
+    st.dataframe(current_tam)
+
     number_of_new_accounts_in_tam=len(new_finess)
     st.markdown(f'New accounts : {number_of_new_accounts_in_tam}')
-    new_tam.loc[new_tam['numero_finess'].isin(list(new_finess)),'new_establishment_this_month']=True
-    new_accounts=new_tam[new_tam['numero_finess'].isin(list(new_finess))]
-    
-    new_accounts_modified=new_accounts.copy()
-    new_accounts_modified.rename(columns={'numero_finess':'finessnumber__c','raison_sociale':'name','telephone':'phone','orga_type':'healthcareservice type','organization_type':'orga type'},inplace=True)
-    new_accounts_modified=new_accounts_modified[opps_columns]
     st.dataframe(new_accounts_modified)
-    csv = new_accounts_modified.to_csv(index=False).encode('utf-8')
     st.markdown("**For DQ Operations team**") 
     st.download_button(
     label="📥   Download new finess accounts as a csv ",
@@ -175,13 +152,8 @@ if current_tam is not None:
     mime='text/csv',
     )
     st.write(' ')
-    current_tam=current_tam[gsheet_columns]
-    current_tam['new_establishment_this_month']=False
-    new_accounts=new_accounts[gsheet_columns]
-    import_gsheet = pd.concat([current_tam, new_accounts], ignore_index=True)
     st.markdown(f'TAM to import gsheet : {len(import_gsheet)} accounts')
     st.dataframe(import_gsheet)
-    csv_import_gsheet = import_gsheet.to_csv(index=False).encode('utf-8')
     st.markdown("**For DQ Projects team**")    
     st.download_button(
     label="📥   Download new csv to replace current linked sheet in metabase ",
@@ -190,4 +162,5 @@ if current_tam is not None:
     mime='text/csv',
     )
 
-    
\ No newline at end of file
+
+current_tam_section()
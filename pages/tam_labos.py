@@ -3,13 +3,14 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from pyproj import Transformer
-from bs4 import BeautifulSoup
-import requests
-from io import StringIO
+from dq.datagouv import known_checksum
+from dq.download import download
+from dq.finess import (
+    VOIE_TYPES, WHITESPACE, address_key, build_adresse, clean_finess, expand_voie_type,
+    fetch_release, load_finess, read_text_csv, split_routage, to_phone, to_text
+)
 
 st.set_page_config(page_title="TAM Labo", layout="wide")
 
@@ -17,73 +18,19 @@ METABASE_URL = "https://metabase.doctolibdata.com/dashboard/5447-tam-labo-dashbo
 
 
 def fetch_latest_finess_urls():
-    url_etab_page = "https://www.data.gouv.fr/datasets/finess-extraction-du-fichier-des-etablissements/#_"
-    page = requests.get(url_etab_page, timeout=30)
-    soup = BeautifulSoup(page.text, "html.parser")
-    url_etabs = soup.find("div", class_="flex items-center buttons").find("a")["href"]
-
-    url_juridique_page = "https://www.data.gouv.fr/datasets/finess-extraction-des-entites-juridiques/"
-    page_jur = requests.get(url_juridique_page, timeout=30)
-    soup_jur = BeautifulSoup(page_jur.text, "html.parser")
-    url_juridique = soup_jur.find("div", class_="flex items-center buttons").find("a")["href"]
-
+    url_etabs, _ = fetch_release('etablissements', timeout=30)
+    url_juridique, _ = fetch_release('juridique', timeout=30)
     return url_etabs, url_juridique
 
+# Cleaned tables are shared by every tab and session of a release (keyed by the
+# resource URL). cache_resource hands out the cached object itself: callers get
+# copies from load_finess_tables() and must not mutate these directly.
+@st.cache_resource(max_entries=2, show_spinner=False)
 def load_finess_etablissements(url_etabs):
-    headers = [
-        "section","numero_finess","numero_finess_juridique","raison_sociale",
-        "raison_sociale_long","raison_sociale_complement","distribution_complement",
-        "voie_numero","voie_type","voie_label","voie_complement","lieu_dit_bp",
-        "ville","departement","departement_label","ligne_acheminement","telephone",
-        "fax","code_categorie","label_categorie","code_status","label_status",
-        "siret","ape","code_tarif","label_tarif","code_psph",
-        "label_psph","date_ouverture","date_autor","date_update","num_uai"
-    ]
-    geoloc_names = ["numero_finess","coord_x","coord_y","source_coord","date_update_coord"]
-
-    df = pd.read_csv(url_etabs, sep=";", skiprows=1, header=None, names=headers, encoding="utf-8")
-    df.drop(columns=["section"], inplace=True)
-
-    geoloc = df.iloc[int(len(df)/2):].copy()
-    geoloc.drop(columns=geoloc.columns[5:], inplace=True)
-    geoloc.columns = [
-        geoloc_names[list(df.columns).index(c)] if list(df.columns).index(c) < len(geoloc_names) else c
-        for c in geoloc.columns
-    ]
-
-    df = df.iloc[:int(len(df)/2)].copy()
-    df["numero_finess"] = df["numero_finess"].astype(str)
-    geoloc["numero_finess"] = geoloc["numero_finess"].astype(str)
-    final = df.merge(geoloc, on="numero_finess", how="left")
-
-    # Clean / enrich
-    dico = {
-        "R":"RUE","PL":"PLACE","RTE":"ROUTE","AV":"AVENUE","GR":"GRANDE RUE","ALL":"ALLEE","CHE":"CHEMIN","QUA":"QUARTIER",
-        "BD":"BOULEVARD","PROM":"PROMENADE","ZA":"ZONE ARTISANALE","QU":"QUAI","ESPA":"ESPACE","IMP":"IMPASSE","LD":"LIEU DIT","SQ":"SQUARE",
-        "LOT":"LOTISSEMENT","ZAC":"ZONE D'AMENAGEMENT CONCERTE","IMM":"IMMEUBLE","RES":"RESIDENCE","CRS":"COURS","ESP":"ESPLANADE","FG":"FAUBOURG",
-        "CHS":"CHAUSSEE","MTE":"MONTEE","DOM":"DOMAINE","PAS":"PASSAGE","SEN":"SENTIER","VAL":"VALLEE","VOI":"VOIE",
-        "PKG":"PARKING","RLE":"RUELLE"
-    }
-    final.replace({"voie_type": dico}, inplace=True)
-    final["raison_sociale"] = final["raison_sociale"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
-    final["adresse"] = (
-        final["voie_numero"].apply(lambda x: str(x).replace(".0","").replace("nan","")) +
-        final["voie_complement"].apply(lambda x: str(x).replace(".0","").replace("nan","")) + " " +
-        final["voie_type"].astype(str) + " " + final["voie_label"].astype(str)
-    ).str.strip()
-    final["code_postal"] = final["ligne_acheminement"].apply(lambda x: str(re.search(r"\d\d\d\d\d|\$", str(x))[0]))
-    final["ville"] = final["ligne_acheminement"].apply(lambda x: re.split(r"\d\d\d\d\d|\$", str(x))[1].strip(" "))
-    final.rename(columns={"ligne_acheminement": "libelle_routage"}, inplace=True)
-    final["telephone"] = final["telephone"].apply(lambda x: ("+33" + str(x).replace(".0","")).replace("+33nan",""))
-    final["fax"] = final["fax"].apply(lambda x: ("+33" + str(x).replace(".0","")).replace("+33nan",""))
-    final["siret"] = final["siret"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
-    final["code_categorie"] = final["code_categorie"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
-    final["code_status"] = final["code_status"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
-    final["code_psph"] = final["code_psph"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
-    final["ape"] = final["ape"].apply(lambda x: str(x).replace(" ","").replace("nan",""))
-
-    return final
+    # Every flow of this page works on labs only (code_categorie 611/612)
+    return clean_finess(load_finess(url_etabs, categories=["611", "612"]))
 
+@st.cache_resource(max_entries=2, show_spinner=False)
 def load_finess_juridique(url_juridique):
     headers_juridique = [
         "section","numero_finess","raison_sociale","raison_sociale_long","raison_sociale_complement",
@@ -92,34 +39,20 @@ def load_finess_juridique(url_juridique):
         "statut_juridique_libel","categorie_etablissement","libelle_categorie_etablissement",
         "numero_de_siren","code_APE","date_de_creation"
     ]
-    df_j = pd.read_csv(url_juridique, sep=";", skiprows=1, header=None, names=headers_juridique, encoding="utf-8")
+    path = download(url_juridique, 'juridique', checksum=known_checksum(url_juridique))
+    df_j = read_text_csv(str(path), headers_juridique, skip_rows=1)
     df_j.drop(columns=["section"], inplace=True)
-    df_j["numero_finess"] = df_j["numero_finess"].astype(str).str.replace(".0","").str.strip()
-
-    dico = {
-        "R":"RUE","PL":"PLACE","RTE":"ROUTE","AV":"AVENUE","GR":"GRANDE RUE","ALL":"ALLEE",
-        "CHE":"CHEMIN","QUA":"QUARTIER","BD":"BOULEVARD","PROM":"PROMENADE","ZA":"ZONE ARTISANALE",
-        "QU":"QUAI","ESPA":"ESPACE","IMP":"IMPASSE","LD":"LIEU DIT","SQ":"SQUARE",
-        "LOT":"LOTISSEMENT","ZAC":"ZONE D'AMENAGEMENT CONCERTE","IMM":"IMMEUBLE","RES":"RESIDENCE",
-        "CRS":"COURS","ESP":"ESPLANADE","FG":"FAUBOURG","CHS":"CHAUSSEE","MTE":"MONTEE",
-        "DOM":"DOMAINE","PAS":"PASSAGE","SEN":"SENTIER","VAL":"VALLEE","VOI":"VOIE",
-        "PKG":"PARKING","RLE":"RUELLE"
-    }
-    df_j.replace({"voie_type": dico}, inplace=True)
-
-    df_j["raison_sociale"] = df_j["raison_sociale"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
-    df_j["adresse"] = (
-        df_j["voie_numero"].apply(lambda x: str(x).replace(".0","").replace("nan","")) +
-        df_j["voie_complement"].apply(lambda x: str(x).replace(".0","").replace("nan","")) + " " +
-        df_j["voie_type"].astype(str) + " " +
-        df_j["voie_label"].astype(str)
-    ).str.strip()
-    df_j["code_postal"] = df_j["ligne_acheminement"].apply(lambda x: str(re.search(r"\d\d\d\d\d|\$", str(x))[0]))
-    df_j["ville"] = df_j["ligne_acheminement"].apply(lambda x: re.split(r"\d\d\d\d\d|\$", str(x))[1].strip(" "))
-    df_j["telephone"] = df_j["telephone"].apply(lambda x: ("+33" + str(x).replace(".0","")).replace("+33nan",""))
-    df_j["numero_de_siren"] = df_j["numero_de_siren"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
-    df_j["code_APE"] = df_j["code_APE"].apply(lambda x: str(x).replace(" ","").replace("nan",""))
-    df_j["statut_juridique"] = df_j["statut_juridique"].apply(lambda x: str(x).replace(".0","").replace("nan",""))
+    df_j["numero_finess"] = to_text(df_j["numero_finess"]).str.strip()
+
+    # Même nettoyage que la base établissements
+    df_j["voie_type"] = expand_voie_type(df_j["voie_type"])
+    df_j["raison_sociale"] = to_text(df_j["raison_sociale"])
+    df_j["adresse"] = build_adresse(df_j["voie_numero"], df_j["voie_complement"], df_j["voie_type"], df_j["voie_label"])
+    df_j["code_postal"], df_j["ville"] = split_routage(df_j["ligne_acheminement"])
+    df_j["telephone"] = to_phone(df_j["telephone"])
+    df_j["numero_de_siren"] = to_text(df_j["numero_de_siren"])
+    df_j["code_APE"] = to_text(df_j["code_APE"]).str.replace(" ", "", regex=False)
+    df_j["statut_juridique"] = to_text(df_j["statut_juridique"])
 
     to_keep_juridique = [
         "numero_finess","numero_de_siren","code_APE","raison_sociale","raison_sociale_long",
@@ -130,17 +63,32 @@ def load_finess_juridique(url_juridique):
     final_j = df_j[to_keep_juridique].copy()
     return final_j
 
-def normalize_address_value(street: str, zipcode: str):
-    if pd.isna(street) or pd.isna(zipcode):
-        return None
-    s = str(street).upper().strip()
-    s = re.sub(r"\s+", " ", s)
-    s = re.sub(r"[^\w\s]", "", s)
-    z = str(zipcode).replace(".0","").strip()
-    return f"{s}|{z}"
+def load_finess_tables():
+    """Load the establishments and legal-entities extracts concurrently.
+
+    Both downloads and parses overlap in a thread pool; only this (main) thread
+    touches the UI, updating one status line per file as each load finishes.
+    """
+    url_etabs, url_juridique = fetch_latest_finess_urls()
+    loaders = {
+        "FINESS establishments": (load_finess_etablissements, url_etabs),
+        "FINESS legal entities": (load_finess_juridique, url_juridique),
+    }
+    status = {label: st.empty() for label in loaders}
+    for label, slot in status.items():
+        slot.caption(f"⏳ {label}: loading...")
+
+    tables = {}
+    with ThreadPoolExecutor(max_workers=len(loaders)) as pool:
+        futures = {pool.submit(load, url): label for label, (load, url) in loaders.items()}
+        for future in as_completed(futures):
+            label = futures[future]
+            tables[label] = future.result().copy()
+            status[label].caption(f"✅ {label}: {len(tables[label])} rows")
+    return tables["FINESS establishments"], tables["FINESS legal entities"]
 
 def add_address_normalized(df, street_col, zipcode_col, out_col="address_normalized"):
-    df[out_col] = df.apply(lambda row: normalize_address_value(row.get(street_col), row.get(zipcode_col)), axis=1)
+    df[out_col] = address_key(df[street_col], df[zipcode_col])
     return df
 
 def export_df_download(df, filename_prefix):
@@ -254,9 +202,9 @@ def compute_labs_and_hierarchy(final_finess_etabs, final_finess_juridique, df_la
         df_labs_export["siret"] = df_labs_to_create["siret"]  # NOUVEAU
         df_labs_export["createddate"] = df_labs_to_create["date_ouverture"]  # NOUVEAU
         df_labs_export["billingstreet"] = (
-            df_labs_to_create["voie_numero"].astype(str).str.replace(".0","").str.replace("nan","") + " " +
-            df_labs_to_create["voie_type"].astype(str).str.replace("nan","") + " " +
-            df_labs_to_create["voie_label"].astype(str).str.replace("nan","")
+            to_text(df_labs_to_create["voie_numero"]) + " " +
+            to_text(df_labs_to_create["voie_type"]) + " " +
+            to_text(df_labs_to_create["voie_label"])
         ).str.strip()
         df_labs_export["billingpostalcode"] = df_labs_to_create["code_postal"]
         df_labs_export["billingcity"] = df_labs_to_create["ville"]
@@ -353,18 +301,12 @@ def compute_labs_and_hierarchy(final_finess_etabs, final_finess_juridique, df_la
 # part gsheet update 
 
 
-def clean_value(x):
-    return str(x).replace('.0', '').replace('nan', '').replace('None', '').strip()
+def clean_column(series):
+    # Stripped text, '' when missing (see dq.finess.to_text), back to plain str
+    return to_text(series).str.strip().astype(object)
 
-def extract_postal(x):
-    match = re.search(r'\d{5}', str(x))
-    if match:
-        return match.group(0).zfill(5)
-    return ''
-
-def extract_city(x):
-    parts = re.split(r'\d{5}', str(x))
-    return parts[1].strip() if len(parts) > 1 else ''
+def format_dates(dates):
+    return dates.dt.strftime('%Y-%m-%d').fillna('')
 
 def process_gsheet_update(gsheet_csv, final_finess_etabs, final_finess_juridique):
     """
@@ -372,16 +314,14 @@ def process_gsheet_update(gsheet_csv, final_finess_etabs, final_finess_juridique
     """
     # Dictionnaire SELAS
     selas_dict = dict(zip(final_finess_juridique['numero_finess'], final_finess_juridique['raison_sociale']))
+    selas_names = pd.Series(selas_dict, dtype=object)
     
     # Charger le gsheet
     gsheet_labs = pd.read_csv(gsheet_csv, dtype=str)
     
     # Nettoyer les colonnes (important pour matching)
-    gsheet_labs['numero_finess'] = gsheet_labs['numero_finess'].apply(clean_value)
-    gsheet_labs['numero_finess_juridique'] = gsheet_labs['numero_finess_juridique'].apply(clean_value)
-    gsheet_labs['raison_sociale'] = gsheet_labs['raison_sociale'].apply(clean_value)
-    gsheet_labs['raison_sociale_longue'] = gsheet_labs['raison_sociale_longue'].apply(clean_value)
-    gsheet_labs['selas'] = gsheet_labs['selas'].apply(clean_value)
+    for col in ['numero_finess', 'numero_finess_juridique', 'raison_sociale', 'raison_sociale_longue', 'selas']:
+        gsheet_labs[col] = clean_column(gsheet_labs[col])
     
     stats = {
         'selas_completes': 0,
@@ -394,115 +334,88 @@ def process_gsheet_update(gsheet_csv, final_finess_etabs, final_finess_juridique
     
     # Compléter SELAS vides (parfois on a le numéro finess juridique mais pas le nom de la SELAS dans la base finess juridique, 
     # l'idée est de voir si deux mois plus tard on l'a)
-    selas_vides = gsheet_labs['selas'] == ''
-    for idx, row in gsheet_labs[selas_vides].iterrows():
-        numero_juridique = clean_value(row['numero_finess_juridique'])
-        if numero_juridique:
-            selas_name = selas_dict.get(numero_juridique, '')
-            if selas_name:
-                gsheet_labs.at[idx, 'selas'] = selas_name
-                stats['selas_completes'] += 1
+    selas_trouvees = gsheet_labs['numero_finess_juridique'].map(selas_names).fillna('')
+    a_completer = (gsheet_labs['selas'] == '') & (gsheet_labs['numero_finess_juridique'] != '') & (selas_trouvees != '')
+    gsheet_labs.loc[a_completer, 'selas'] = selas_trouvees[a_completer]
+    stats['selas_completes'] = int(a_completer.sum())
     
-    # Mise à jour des labos existants
-    for idx, row in gsheet_labs.iterrows():
-        numero_finess = clean_value(row['numero_finess'])
-        finess_row = final_finess_etabs[final_finess_etabs['numero_finess'] == numero_finess]
-        
-        if not finess_row.empty:
-            finess_row = finess_row.iloc[0]
-            
-            # Raison sociale
-            if clean_value(row['raison_sociale']) != clean_value(finess_row['raison_sociale']):
-                gsheet_labs.at[idx, 'raison_sociale'] = clean_value(finess_row['raison_sociale'])
-                stats['raison_sociale'] += 1
-            
-            # Raison sociale longue
-            if clean_value(row['raison_sociale_longue']) != clean_value(finess_row['raison_sociale_long']):
-                gsheet_labs.at[idx, 'raison_sociale_longue'] = clean_value(finess_row['raison_sociale_long'])
-                stats['raison_sociale_longue'] += 1
-            
-            # Numéro FINESS juridique
-            if clean_value(row['numero_finess_juridique']) != clean_value(finess_row['numero_finess_juridique']):
-                new_juridique = clean_value(finess_row['numero_finess_juridique'])
-                gsheet_labs.at[idx, 'numero_finess_juridique'] = new_juridique
-                stats['numero_finess_juridique'] += 1
-                
-                # Mettre à jour SELAS
-                new_selas = selas_dict.get(new_juridique, '')
-                gsheet_labs.at[idx, 'selas'] = new_selas
-                stats['selas_updates'] += 1
-                
-                # Effacer labo_group
-                gsheet_labs.at[idx, 'labo_group'] = ''
+    # Mise à jour des labos existants : jointure sur numero_finess (première ligne FINESS par numéro)
+    finess_par_numero = final_finess_etabs.drop_duplicates('numero_finess').set_index('numero_finess')
+    trouves = gsheet_labs['numero_finess'].isin(finess_par_numero.index).to_numpy()
+    finess_rows = finess_par_numero.reindex(gsheet_labs['numero_finess'])
+    
+    for col_gsheet, col_finess in [('raison_sociale', 'raison_sociale'), ('raison_sociale_longue', 'raison_sociale_long')]:
+        valeur_finess = clean_column(finess_rows[col_finess]).to_numpy()
+        modifies = trouves & (gsheet_labs[col_gsheet].to_numpy() != valeur_finess)
+        gsheet_labs.loc[modifies, col_gsheet] = valeur_finess[modifies]
+        stats[col_gsheet] = int(modifies.sum())
+    
+    # Numéro FINESS juridique : mettre à jour SELAS et effacer labo_group
+    nouveau_juridique = clean_column(finess_rows['numero_finess_juridique']).to_numpy()
+    modifies = trouves & (gsheet_labs['numero_finess_juridique'].to_numpy() != nouveau_juridique)
+    if modifies.any():
+        gsheet_labs.loc[modifies, 'numero_finess_juridique'] = nouveau_juridique[modifies]
+        gsheet_labs.loc[modifies, 'selas'] = pd.Series(nouveau_juridique[modifies], dtype=object).map(selas_names).fillna('').to_numpy()
+        gsheet_labs.loc[modifies, 'labo_group'] = ''
+    stats['numero_finess_juridique'] = int(modifies.sum())
+    stats['selas_updates'] = int(modifies.sum())
     
     # Ajouter nouveaux laboratoires
     existing_finess = set(gsheet_labs['numero_finess'])
     new_labs = final_finess_etabs[~final_finess_etabs['numero_finess'].isin(existing_finess)].copy()
     
     if len(new_labs) > 0:
-        nouvelles_lignes = []
+        selas_new = clean_column(new_labs['numero_finess_juridique']).map(selas_names).fillna('')
         
-        for _, lab in new_labs.iterrows():
-            selas_name = selas_dict.get(clean_value(lab['numero_finess_juridique']), '')
-            
-            # Dictionnaire voies
-            dico = {
-                'R':'RUE', 'PL':'PLACE', 'RTE':'ROUTE', 'AV':'AVENUE', 'GR':'GRANDE RUE', 'ALL':'ALLEE',
-                'CHE':'CHEMIN', 'QUA':'QUARTIER', 'BD':'BOULEVARD', 'PROM':'PROMENADE', 'ZA':'ZONE ARTISANALE',
-                'QU':'QUAI', 'ESPA':'ESPACE', 'IMP':'IMPASSE', 'LD':'LIEU DIT', 'SQ':'SQUARE',
-                'LOT':'LOTISSEMENT', 'ZAC':"ZONE D'AMENAGEMENT CONCERTE", 'IMM':'IMMEUBLE', 'RES':'RESIDENCE',
-                'CRS':'COURS', 'ESP':'ESPLANADE', 'FG':'FAUBOURG', 'CHS':'CHAUSSEE', 'MTE':'MONTEE',
-                'DOM':'DOMAINE', 'PAS':'PASSAGE', 'SEN':'SENTIER', 'VAL':'VALLEE', 'VOI':'VOIE',
-                'PKG':'PARKING', 'RLE':'RUELLE'
-            }
-            
-            voie_type_complet = dico.get(str(lab['voie_type']), str(lab['voie_type']))
-            adress = f"{clean_value(lab['voie_numero'])} {clean_value(lab['voie_complement'])} {voie_type_complet} {clean_value(lab['voie_label'])}".strip()
-            adress = re.sub(r'\s+', ' ', adress)
-            
-            nouvelle_ligne = {
-                'numero_finess': lab['numero_finess'],
-                'numero_finess_juridique': lab['numero_finess_juridique'],
-                'raison_sociale': clean_value(lab['raison_sociale']),
-                'raison_sociale_longue': clean_value(lab['raison_sociale_long']),
-                'selas': selas_name,
-                'labo_group': '',
-                'complement_raison_sociale': clean_value(lab['raison_sociale_complement']),
-                'complement_de_distribution': clean_value(lab['distribution_complement']),
-                'numer_de_voie': clean_value(lab['voie_numero']),
-                'type_de_voie': str(lab['voie_type']),
-                'libelle_de_voie': clean_value(lab['voie_label']),
-                'complement_de_voie': clean_value(lab['voie_complement']),
-                'lieu': clean_value(lab['lieu_dit_bp']),
-                'code_commune': clean_value(lab['ville']),
-                'departement': str(lab['departement']),
-                'libelle_departement': str(lab['departement_label']),
-                'ligne_acheminement': str(lab['libelle_routage']),
-                'adress': adress,
-                'code_postal': extract_postal(lab['libelle_routage']),
-                'city': extract_city(lab['libelle_routage']),
-                'telephone': str(lab['telephone']),
-                'fax': str(lab['fax']),
-                'code_categorie': clean_value(lab['code_categorie']),
-                'libelle_categorie': str(lab['label_categorie']),
-                'categorie_agregat_etablissement': '',
-                'libelle_categorie_agregat_etablissement': '',
-                'siret': clean_value(lab['siret']),
-                'code_ape': clean_value(lab['ape']),
-                'code_mft': '',
-                'libelle_mft': '',
-                'code_sph': clean_value(lab['code_psph']),
-                'libelle_sph': str(lab['label_psph']),
-                'date_ouverture': str(lab['date_ouverture']),
-                'date_autorisation': str(lab['date_autor']),
-                'date_mise_jour': str(lab['date_update'])
-            }
-            
-            nouvelles_lignes.append(nouvelle_ligne)
+        # Adresse : type de voie en toutes lettres, espaces multiples réduits
+        voie_type = to_text(new_labs['voie_type'])
+        voie_type_complet = voie_type.map(VOIE_TYPES).fillna(voie_type)
+        adress = (
+            clean_column(new_labs['voie_numero']) + ' ' + clean_column(new_labs['voie_complement']) + ' '
+            + voie_type_complet + ' ' + clean_column(new_labs['voie_label'])
+        ).str.strip().str.replace(WHITESPACE, ' ', regex=True)
+        code_postal, city = split_routage(new_labs['libelle_routage'])
+        
+        df_nouvelles = pd.DataFrame({
+            'numero_finess': new_labs['numero_finess'],
+            'numero_finess_juridique': new_labs['numero_finess_juridique'],
+            'raison_sociale': clean_column(new_labs['raison_sociale']),
+            'raison_sociale_longue': clean_column(new_labs['raison_sociale_long']),
+            'selas': selas_new,
+            'labo_group': '',
+            'complement_raison_sociale': clean_column(new_labs['raison_sociale_complement']),
+            'complement_de_distribution': clean_column(new_labs['distribution_complement']),
+            'numer_de_voie': clean_column(new_labs['voie_numero']),
+            'type_de_voie': voie_type,
+            'libelle_de_voie': clean_column(new_labs['voie_label']),
+            'complement_de_voie': clean_column(new_labs['voie_complement']),
+            'lieu': clean_column(new_labs['lieu_dit_bp']),
+            'code_commune': clean_column(new_labs['ville']),
+            'departement': to_text(new_labs['departement']),
+            'libelle_departement': to_text(new_labs['departement_label']),
+            'ligne_acheminement': to_text(new_labs['libelle_routage']),
+            'adress': adress,
+            'code_postal': code_postal,
+            'city': city,
+            'telephone': to_text(new_labs['telephone']),
+            'fax': to_text(new_labs['fax']),
+            'code_categorie': clean_column(new_labs['code_categorie']),
+            'libelle_categorie': to_text(new_labs['label_categorie']),
+            'categorie_agregat_etablissement': '',
+            'libelle_categorie_agregat_etablissement': '',
+            'siret': clean_column(new_labs['siret']),
+            'code_ape': clean_column(new_labs['ape']),
+            'code_mft': '',
+            'libelle_mft': '',
+            'code_sph': clean_column(new_labs['code_psph']),
+            'libelle_sph': to_text(new_labs['label_psph']),
+            'date_ouverture': format_dates(new_labs['date_ouverture']),
+            'date_autorisation': format_dates(new_labs['date_autor']),
+            'date_mise_jour': format_dates(new_labs['date_update'])
+        })
         
-        df_nouvelles = pd.DataFrame(nouvelles_lignes)
         gsheet_updated = pd.concat([gsheet_labs, df_nouvelles], ignore_index=True)
-        stats['nouveaux_labs'] = len(nouvelles_lignes)
+        stats['nouveaux_labs'] = len(df_nouvelles)
     else:
         gsheet_updated = gsheet_labs
     
@@ -540,9 +453,7 @@ with tab1:
             st.error("Please upload CSV DQ Ops SELAS.")
         else:
             try:
-                url_etabs, url_juridique = fetch_latest_finess_urls()
-                fin_etabs = load_finess_etablissements(url_etabs)
-                fin_juridique = load_finess_juridique(url_juridique)
+                fin_etabs, fin_juridique = load_finess_tables()
 
                 df_selas_sf = pd.read_csv(uploaded_selas_sf)
 
@@ -571,9 +482,7 @@ with tab2:
             st.error("Please upload CSV DQ Ops Labs & DQ Ops SELAS.")
         else:
             try:
-                url_etabs, url_juridique = fetch_latest_finess_urls()
-                fin_etabs = load_finess_etablissements(url_etabs)
-                fin_juridique = load_finess_juridique(url_juridique)
+                fin_etabs, fin_juridique = load_finess_tables()
 
                 df_labs_sf = pd.read_csv(uploaded_labs_sf)
                 df_selas_sf = pd.read_csv(uploaded_selas_sf_2)
@@ -620,12 +529,10 @@ with tab3:
         else:
             try:
                 with st.spinner("Loading FINESS databases..."):
-                    url_etabs, url_juridique = fetch_latest_finess_urls()
-                    fin_etabs = load_finess_etablissements(url_etabs)
-                    fin_juridique = load_finess_juridique(url_juridique)
+                    fin_etabs, fin_juridique = load_finess_tables()
                     
                     # Nettoyer et préparer FINESS
-                    fin_etabs['code_categorie'] = fin_etabs['code_categorie'].apply(clean_value)
+                    fin_etabs['code_categorie'] = clean_column(fin_etabs['code_categorie'])
                     scope = ["611", "612"]
                     fin_etabs = fin_etabs[fin_etabs['code_categorie'].isin(scope)].copy()
                     
@@ -634,13 +541,12 @@ with tab3:
                                'distribution_complement', 'voie_numero', 'voie_complement', 
                                'lieu_dit_bp', 'ville', 'voie_label']:
                         if col in fin_etabs.columns:
-                            fin_etabs[col] = fin_etabs[col].apply(clean_value)
+                            fin_etabs[col] = clean_column(fin_etabs[col])
                     
-                    fin_etabs['code_postal'] = fin_etabs['libelle_routage'].apply(extract_postal)
-                    fin_etabs['city'] = fin_etabs['libelle_routage'].apply(extract_city)
+                    fin_etabs['code_postal'], fin_etabs['city'] = split_routage(fin_etabs['libelle_routage'])
                     
-                    fin_juridique['numero_finess'] = fin_juridique['numero_finess'].apply(clean_value)
-                    fin_juridique['raison_sociale'] = fin_juridique['raison_sociale'].apply(clean_value)
+                    fin_juridique['numero_finess'] = clean_column(fin_juridique['numero_finess'])
+                    fin_juridique['raison_sociale'] = clean_column(fin_juridique['raison_sociale'])
                 
                 with st.spinner("Processing Gsheet update..."):
                     gsheet_updated, stats = process_gsheet_update(uploaded_gsheet, fin_etabs, fin_juridique)
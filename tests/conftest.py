@@ -0,0 +1,40 @@
+import pytest
+
+import dq.finess
+from dq.finess import HEADERS
+
+# Two labs (one without a street number, one with no complement nor lieu-dit)
+# and a pharmacy, with their coordinates.
+ESTABLISHMENTS = [
+    {'numero_finess': '750000011', 'numero_finess_juridique': '750000010',
+     'raison_sociale': 'LABO DE LA PAIX', 'raison_sociale_long': 'LABORATOIRE DE LA PAIX',
+     'voie_type': 'R', 'voie_label': 'DE LA PAIX 3', 'departement': '75', 'departement_label': 'PARIS',
+     'ligne_acheminement': '75002 PARIS', 'telephone': '0142000000', 'code_categorie': '611',
+     'label_categorie': 'Laboratoire', 'siret': '12345678900011', 'ape': '86 90B',
+     'date_ouverture': '2001-01-01', 'date_update': '2020-01-02'},
+    {'numero_finess': '130000021', 'numero_finess_juridique': '130000020',
+     'raison_sociale': 'LABO FOCH', 'raison_sociale_long': 'LABORATOIRE FOCH',
+     'voie_numero': '18', 'voie_type': 'AV', 'voie_label': 'FOCH', 'departement': '13',
+     'departement_label': 'BOUCHES-DU-RHONE', 'ligne_acheminement': '13001 MARSEILLE CEDEX 01',
+     'code_categorie': '612', 'label_categorie': 'Labo site', 'code_psph': '2',
+     'date_ouverture': '2010-05-04', 'date_update': '2021-03-04'},
+    {'numero_finess': '010000031', 'numero_finess_juridique': '010000030',
+     'raison_sociale': 'PHARMACIE CENTRALE', 'voie_numero': '1', 'voie_type': 'PL',
+     'voie_label': 'DE LA MAIRIE', 'departement': '01', 'departement_label': 'AIN',
+     'ligne_acheminement': '01000 BOURG EN BRESSE', 'code_categorie': '620',
+     'label_categorie': "Pharmacie d'Officine", 'date_ouverture': '1990-01-01'},
+]
+
+
+@pytest.fixture
+def finess_extract(tmp_path, monkeypatch):
+    """Path of a small FINESS extract; its snapshots go to a temporary cache."""
+    monkeypatch.setattr(dq.finess, 'CACHE_DIR', tmp_path / 'cache')
+    lines = ['finess;etalab;95;2024-09-01']
+    for etab in ESTABLISHMENTS:
+        lines.append(';'.join(['structureet'] + [etab.get(col, '') for col in HEADERS[1:]]))
+    for i, etab in enumerate(ESTABLISHMENTS):
+        lines.append(f"geolocalisation;{etab['numero_finess']};65{i}243.9;6860000.0;1,ATLASANTE;2021-03-04")
+    path = tmp_path / 'etalab_cs1100507_stock.csv'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
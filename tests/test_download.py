@@ -0,0 +1,133 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import requests
+
+import dq.download
+from dq.download import download, mirror_path, write_parquet
+
+PAYLOAD = bytes(range(256)) * 256
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Stand-in for data.gouv: ETag validation, ranges guarded by If-Range, cut transfers."""
+
+    def do_GET(self):
+        remote = self.server.remote
+        remote['requests'].append({key: self.headers.get(key) for key in ('If-None-Match', 'Range', 'If-Range')})
+        payload, etag = remote['payload'], remote['etag']
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == etag:
+            start = int(self.headers['Range'].removeprefix('bytes=').rstrip('-'))
+            if start >= len(payload):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(payload)}")
+                self.end_headers()
+                return
+        body = payload[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        if start:
+            self.send_header('Content-Range', f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+        self.end_headers()
+        cut_after = remote.pop('cut_after', None)
+        self.wfile.write(body[:cut_after])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def remote():
+    """Settings and received requests of a local HTTP server, with its URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.remote = {'payload': PAYLOAD, 'etag': '"v1"', 'requests': []}
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    server.remote['url'] = f"http://127.0.0.1:{server.server_port}/etalab_stock.csv"
+    yield server.remote
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    # Small chunks, so that a cut transfer leaves bytes to resume from.
+    monkeypatch.setattr(dq.download, 'CHUNK_SIZE', 4096)
+    return tmp_path
+
+
+def cut_download(remote, mirror):
+    """Download with the connection cut after 20000 bytes, leaving a ``.part`` file."""
+    remote['cut_after'] = 20000
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download(remote['url'], 'finess', mirror_dir=mirror)
+
+
+def test_unchanged_file_is_revalidated(remote, mirror):
+    path = download(remote['url'], 'finess', mirror_dir=mirror)
+    assert path.read_bytes() == PAYLOAD
+    assert download(remote['url'], 'finess', mirror_dir=mirror) == path
+    assert path.read_bytes() == PAYLOAD
+    assert [r['If-None-Match'] for r in remote['requests']] == [None, '"v1"']
+
+
+def test_interrupted_download_resumes(remote, mirror):
+    cut_download(remote, mirror)
+    part = mirror_path(remote['url'], 'finess', mirror).with_suffix('.csv.part')
+    offset = part.stat().st_size
+    assert 0 < offset <= 20000
+
+    path = download(remote['url'], 'finess', mirror_dir=mirror)
+    assert path.read_bytes() == PAYLOAD
+    assert remote['requests'][-1] == {'If-None-Match': None, 'Range': f"bytes={offset}-", 'If-Range': '"v1"'}
+    assert not part.exists()
+
+
+def test_changed_file_is_downloaded_again(remote, mirror):
+    cut_download(remote, mirror)
+    remote.update(payload=PAYLOAD[::-1], etag='"v2"')
+
+    path = download(remote['url'], 'finess', mirror_dir=mirror)
+    # If-Range did not match: the server sent the whole new file
+    assert path.read_bytes() == PAYLOAD[::-1]
+    assert remote['requests'][-1]['If-Range'] == '"v1"'
+
+
+def test_unsatisfiable_range_restarts(remote, mirror):
+    cut_download(remote, mirror)
+    remote['payload'] = PAYLOAD[:10000]
+
+    path = download(remote['url'], 'finess', mirror_dir=mirror)
+    assert path.read_bytes() == PAYLOAD[:10000]
+    assert [r['Range'] is not None for r in remote['requests'][1:]] == [True, False]
+
+
+def test_checksum_mismatch_is_not_published(remote, mirror):
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        download(remote['url'], 'finess', checksum=('sha1', '0' * 40), mirror_dir=mirror)
+    assert list(mirror.iterdir()) == []
+
+    checksum = ('sha1', hashlib.sha1(PAYLOAD).hexdigest())
+    assert download(remote['url'], 'finess', checksum=checksum, mirror_dir=mirror).read_bytes() == PAYLOAD
+
+
+def test_write_parquet_publishes_files_and_directories(tmp_path):
+    df = pd.DataFrame({'numero_finess': ['010000031'], 'x': [1.5]})
+    assert write_parquet(df, tmp_path / 'finess.parquet')
+    assert pd.read_parquet(tmp_path / 'finess.parquet').equals(df)
+
+    assert write_parquet({'a': df, 'b': df.head(0)}, tmp_path / 'snapshot')
+    assert sorted(p.name for p in (tmp_path / 'snapshot').iterdir()) == ['a.parquet', 'b.parquet']
+    # Another writer published the directory first: this one leaves nothing behind.
+    assert not write_parquet({'a': df}, tmp_path / 'snapshot')
+    assert not write_parquet(pd.DataFrame({'bad': [object()]}), tmp_path / 'bad.parquet')
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['finess.parquet', 'snapshot']
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from dq.finess import TAM_COLUMNS, TEXT_DTYPE, address_key, load_finess, split_routage, to_text
+
+
+def test_snapshot_gives_back_the_parsed_table(finess_extract):
+    parsed = load_finess(finess_extract)
+    assert parsed['voie_numero'].dtype == TEXT_DTYPE and parsed['label_tarif'].dtype == 'category'
+    pd.testing.assert_frame_equal(load_finess(finess_extract), parsed)
+
+    labs = parsed[parsed['code_categorie'].isin(['611', '612'])].reset_index(drop=True)[TAM_COLUMNS]
+    pd.testing.assert_frame_equal(load_finess(finess_extract, TAM_COLUMNS, categories=[611, 612]), labs)
+
+
+def test_address_key_reads_zipcodes_of_any_dtype():
+    street = pd.Series(['12, rue  de la Paix', '3 av. Foch', '1 PL DE LA MAIRIE', None])
+    keys = ['12 RUE DE LA PAIX|75002', '3 AV FOCH|13001', None, None]
+    assert address_key(street, pd.Series([75002.0, 13001.0, np.nan, 1000.0])).tolist() == keys
+    zipcode = pd.Series(['75002', '13001 ', None, '01000'], dtype=TEXT_DTYPE)
+    assert address_key(street, zipcode).tolist() == keys
+
+
+def test_to_text_only_drops_the_decimal_part_of_numbers():
+    assert to_text(pd.Series([750000011.0, np.nan])).tolist() == ['750000011', '']
+    for dtype in [object, TEXT_DTYPE]:
+        values = pd.Series(['10.05', 'Ferdinand', None, 'nan'], dtype=dtype)
+        assert to_text(values).tolist() == ['10.05', 'Ferdinand', '', 'nan']
+
+
+def test_split_routage():
+    lines = pd.Series(['75002 PARIS', '13001 MARSEILLE CEDEX 01 13998', 'CEDEX SANS CP', None],
+                      index=[3, 1, 2, 0], dtype=TEXT_DTYPE)
+    code_postal, ville = split_routage(lines)
+    assert code_postal.index.tolist() == [3, 1, 2, 0]
+    assert code_postal.tolist() == ['75002', '13001', '', '']
+    assert ville.tolist() == ['PARIS', 'MARSEILLE CEDEX 01', '', '']
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from dq.matching import Field, best_first, blocked_match
+
+
+def test_best_first_gives_a_taken_candidate_to_the_next_best():
+    # L1/R1 = 1.0, L2/R1 = 0.905, L2/R2 = 0.769: R1 goes to L1, L2 falls back on R2.
+    kept = best_first(np.array([0, 1, 1]), np.array([0, 0, 1]))
+    assert kept.tolist() == [0, 2]
+
+
+def test_blocked_match_falls_back_on_the_next_free_candidate():
+    left = pd.DataFrame({
+        'id': ['L1', 'L2'],
+        'name': ['PHARMACIE DU CENTRE', 'PHARMACIE DU CENTRE SUD'],
+        'cp': ['75001', '75001'],
+    })
+    right = pd.DataFrame({
+        'fid': ['R1', 'R2'],
+        'name': ['PHARMACIE DU CENTRE', 'PHARMACIE CENTRE SUD'],
+        'cp': ['75001', '75001'],
+    })
+    # L2 scores higher against R1 (0.826) than against R2 (0.792), but R1 is L1's.
+    matches = blocked_match(left, right, 'cp', 'cp', [Field(['name'], 'name', 1)], 'id', 'fid',
+                            threshold=0.7)
+    assert list(zip(matches['id'], matches['fid'])) == [('L1', 'R1'), ('L2', 'R2')]
+    assert matches['score'].tolist() == [1.0, 0.792]
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from dq.phone import normalize_phone
+
+
+def test_normalize_phone_writes_french_numbers_in_e164():
+    numbers = pd.Series(['01 23 45 67 89', '01.23.45.67.89', '123456789', '123456789.0', '0033 1 23 45 67 89',
+                         '+33 (0)1 23 45 67 89', '33123456789'], index=range(10, 17))
+    phones, valid = normalize_phone(numbers)
+    assert phones.index.tolist() == list(range(10, 17))
+    assert phones.tolist() == ['+33123456789'] * 7
+    assert valid.all()
+
+
+def test_normalize_phone_reads_numbers_parsed_as_floats():
+    phones, valid = normalize_phone(pd.Series([123456789.0, 612345678.0, np.nan]))
+    assert phones.tolist()[:2] == ['+33123456789', '+33612345678']
+    assert valid.tolist() == [True, True, False]
+
+
+def test_normalize_phone_flags_invalid_and_missing_numbers():
+    phones, valid = normalize_phone(pd.Series(['+44 20 7946 0958', '12', '', None, '0123.0']))
+    assert phones[[0, 1, 4]].tolist() == ['+442079460958', '12', '0123']
+    assert phones[2:4].isna().all()
+    assert valid.tolist() == [True, False, False, False, False]
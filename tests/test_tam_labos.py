@@ -0,0 +1,70 @@
+import importlib.util
+import io
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from dq.finess import clean_finess, load_finess
+
+PAGE = Path(__file__).resolve().parent.parent / 'pages' / 'tam_labos.py'
+
+
+@pytest.fixture(scope='module')
+def page():
+    # Outside `streamlit run` the page only lays out its widgets (no button is clicked).
+    spec = importlib.util.spec_from_file_location('tam_labos', PAGE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=['parsed', 'snapshot'])
+def labs(request, finess_extract):
+    """Cleaned labs of the extract, from a fresh parse and from its snapshot."""
+    if request.param == 'snapshot':
+        load_finess(finess_extract)
+    return clean_finess(load_finess(finess_extract, categories=['611', '612']))
+
+
+@pytest.fixture
+def juridique():
+    return pd.DataFrame({'numero_finess': ['750000010'], 'raison_sociale': ['SELAS PAIX']})
+
+
+def missing_as_text(df):
+    """Cells of ``df`` holding the text of a missing value."""
+    text = df.astype(str)
+    return text[text.isin(['nan', '<NA>', 'None']) | text.apply(lambda c: c.str.contains('<NA>'))].stack()
+
+
+def test_clean_column_keeps_values_whole(page):
+    values = pd.Series(['10.05', ' Ferdinand ', None, 'LABO nanterre'], dtype=object)
+    assert page.clean_column(values).tolist() == ['10.05', 'Ferdinand', '', 'LABO nanterre']
+
+
+def test_new_labs_export_has_no_missing_value_text(page, labs, juridique):
+    labs_sf = pd.DataFrame({'id': ['a1'], 'numero_finess': ['999999999'], 'street': ['1 RUE X'],
+                            'zipcode': ['75001'], 'selas_id': ['s1']})
+    selas_sf = pd.DataFrame({'id': ['s1'], 'numero_finess': ['750000010']})
+    export, _, metrics, _, _ = page.compute_labs_and_hierarchy(labs, juridique, labs_sf, selas_sf)
+
+    assert metrics['labs_to_create'] == 2
+    streets = dict(zip(export['finessnumber__c'], export['billingstreet']))
+    assert streets == {'750000011': 'RUE DE LA PAIX 3', '130000021': '18 AVENUE FOCH'}
+    assert missing_as_text(export).empty
+
+
+def test_gsheet_new_rows_have_no_missing_value_text(page, labs, juridique):
+    gsheet = io.StringIO('numero_finess,numero_finess_juridique,raison_sociale,raison_sociale_longue,'
+                         'selas,labo_group,code_postal\n750000011,,LABO DE LA PAIX,,,g,75002\n')
+    updated, stats = page.process_gsheet_update(gsheet, labs, juridique)
+
+    assert stats['nouveaux_labs'] == 1
+    assert stats['selas_completes'] == 0 and stats['numero_finess_juridique'] == 1
+    assert updated.loc[0, 'selas'] == 'SELAS PAIX'
+    new = updated.iloc[1:]
+    assert new['adress'].tolist() == ['18 AVENUE FOCH']
+    assert new[['numer_de_voie', 'complement_de_voie', 'lieu', 'fax']].values.tolist() == [['18', '', '', '']]
+    assert new['city'].tolist() == ['MARSEILLE CEDEX 01']
+    assert missing_as_text(new.drop(columns='code_postal')).empty